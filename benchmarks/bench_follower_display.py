@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Bilibili Follower Display 基准测试
+无需 Minecraft 服务端和B站接口：
+- StubServer 模拟 MCDR ServerInterface，记录 execute/say 调用及时间戳
+- 本地 HTTP 服务模拟 /x/web-interface/card 和批量接口 /x/relation/stats，可配置延迟和错误率
+- 命令间隔按 --time-scale 缩放（默认 1 秒的间隔实际只等待 1 毫秒），
+  报告中同时给出实际耗时和换算回真实间隔后的耗时
+
+用法（在仓库根目录执行，需安装 mcdreforged 和 requests）：
+    python benchmarks/bench_follower_display.py --boards 30 --digits 9
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import follower_display  # noqa: E402
+
+
+class StubServer:
+    """模拟 MCDR ServerInterface，记录所有命令和消息"""
+
+    def __init__(self):
+        self.logger = logging.getLogger('bench')
+        self.data_folder = tempfile.mkdtemp(prefix='bfan_bench_')
+        self.executed = []  # [(时间戳, 命令)]
+        self.said = []  # [(时间戳, 消息)]
+        self._lock = threading.Lock()
+
+    def get_data_folder(self):
+        return self.data_folder
+
+    def execute(self, command):
+        with self._lock:
+            self.executed.append((time.perf_counter(), command))
+
+    def say(self, message):
+        with self._lock:
+            self.said.append((time.perf_counter(), message))
+
+    def reply(self, info, message):
+        self.say(message)
+
+    def save_config_simple(self, config, file_name):
+        with open(os.path.join(self.data_folder, file_name), 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+
+    def register_help_message(self, *args, **kwargs):
+        pass
+
+    def is_rcon_running(self):
+        return False
+
+    def rcon_query(self, command):
+        return None
+
+    def dispatch_event(self, event, args, **kwargs):
+        pass
+
+    def reset(self):
+        with self._lock:
+            self.executed.clear()
+            self.said.clear()
+
+    def cleanup(self):
+        shutil.rmtree(self.data_folder, ignore_errors=True)
+
+
+def start_card_server(latency, error_rate, digits):
+    """启动模拟B站 card 接口和批量粉丝数接口的本地 HTTP 服务"""
+
+    def random_fans():
+        return random.randint(10 ** (digits - 1), 10 ** digits - 1)
+
+    class CardHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if latency:
+                time.sleep(latency)
+            if random.random() < error_rate:
+                body = json.dumps({'code': -412, 'message': '请求被拦截'}).encode()
+            elif url.path.endswith('/stats'):
+                mids = query.get('mids', [''])[0].split(',')
+                body = json.dumps({'code': 0, 'data': {mid: {'mid': int(mid), 'follower': random_fans()} for mid in mids}}).encode()
+            else:
+                mid = query.get('mid', ['0'])[0]
+                body = json.dumps({'code': 0, 'data': {'card': {'mid': mid, 'name': f'up{mid}', 'fans': random_fans()}}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CardHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='BenchCardServer', daemon=True).start()
+    return server
+
+
+def count_plugin_threads():
+    """插件自身创建的线程数（线程名以 BFan 开头）"""
+    return sum(1 for thread in threading.enumerate() if thread.name.startswith('BFan'))
+
+
+class ThreadSampler:
+    """后台采样线程数峰值（总数及插件线程数）"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.plugin_peak = count_plugin_threads()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, threading.active_count())
+            self.plugin_peak = max(self.plugin_peak, count_plugin_threads())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def make_displays(boards, delay, shared_bot, render_backend='commands', digits=9):
+    """生成 N 个显示板配置"""
+    template = follower_display.config['displays'][0]
+    displays = []
+    for i in range(boards):
+        display = dict(template)
+        display.update({
+            'name': f'board{i}',
+            'mid': str(100000 + i),
+            'bot_name': 'Fan' if shared_bot else f'Fan{i}',
+            'delay_between_commands': delay,
+            'render_backend': render_backend,
+            'digit_positions': [f'{column} {64 + i} 0' for column in range(digits)]
+        })
+        displays.append(display)
+    return displays
+
+
+def bench_fetch(boards):
+    """批量查询吞吐（先预热一轮，batch 模式需要先通过 card 接口取得用户名）"""
+    mids = [d['mid'] for d in follower_display.config['displays']][:boards]
+    follower_display.fetch_follower_counts(mids)
+    follower_display.clear_follower_cache()
+    http_before = follower_display.get_metrics()['counters'].get('fetch_requests_total', 0)
+    start = time.perf_counter()
+    results = follower_display.fetch_follower_counts(mids)
+    elapsed = time.perf_counter() - start
+    http_requests = follower_display.get_metrics()['counters'].get('fetch_requests_total', 0) - http_before
+    failures = sum(1 for data in results.values() if data.get('code') != 0)
+    return {
+        'requests': len(mids),
+        'http_requests': http_requests,
+        'failures': failures,
+        'seconds': elapsed,
+        'throughput': len(mids) / elapsed if elapsed else float('inf')
+    }
+
+
+def bench_redraw(server, digits, only_changed, base_delay, time_scale):
+    """所有显示板同时提交重绘，等待全部完成"""
+    server.reset()
+    numbers = {}
+    for display in follower_display.config['displays']:
+        old = follower_display.load_cache(display['name'])
+        if only_changed and old is not None:
+            numbers[display['name']] = old + 1
+        else:
+            numbers[display['name']] = random.randint(10 ** (digits - 1), 10 ** digits - 1)
+
+    start = time.perf_counter()
+    futures = [
+        follower_display.display_number(server, number, name, only_changed=only_changed, group='bench')
+        for name, number in numbers.items()
+    ]
+    for future in futures:
+        future.result(timeout=600)
+    elapsed = time.perf_counter() - start
+
+    commands = len(server.executed)
+    boards = len(numbers)
+    return {
+        'boards': boards,
+        'commands': commands,
+        'commands_per_redraw': commands / boards if boards else 0,
+        'seconds': elapsed,
+        'virtual_seconds': elapsed / time_scale,
+        'serial_virtual_seconds': commands * base_delay
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bilibili Follower Display 基准测试')
+    parser.add_argument('--boards', type=int, default=30, help='显示板数量')
+    parser.add_argument('--digits', type=int, default=9, help='粉丝数位数')
+    parser.add_argument('--delay', type=float, default=1.0, help='真实服务端中的命令间隔（秒）')
+    parser.add_argument('--time-scale', type=float, default=0.001, help='命令间隔缩放比例')
+    parser.add_argument('--latency', type=float, default=0.05, help='模拟接口延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟接口返回 -412 的概率')
+    parser.add_argument('--concurrency', type=int, default=4, help='max_concurrent_renders')
+    parser.add_argument('--fetch-workers', type=int, default=8, help='fetch_workers')
+    parser.add_argument('--rate-limit', type=float, default=0, help='rate_limit_per_second，0 为不限制')
+    parser.add_argument('--backend', choices=('card', 'batch'), default='card', help='fetch_backend')
+    parser.add_argument('--batch-size', type=int, default=20, help='batch_size')
+    parser.add_argument('--shared-bot', action='store_true', help='所有显示板共用一个假人')
+    parser.add_argument('--render-backend', choices=('commands', 'blocks'), default='commands', help='render_backend')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING)
+    card_server = start_card_server(args.latency, args.error_rate, args.digits)
+    server = StubServer()
+    try:
+        follower_display.on_load(server, None)
+        follower_display.config.update({
+            'log_enabled': False,
+            'fetch_workers': args.fetch_workers,
+            'rate_limit_per_second': args.rate_limit,
+            'fetch_backend': args.backend,
+            'batch_size': args.batch_size,
+            'max_concurrent_renders': args.concurrency,
+            'http_retries': 0,
+            'displays': make_displays(args.boards, args.delay * args.time_scale, args.shared_bot,
+                                      args.render_backend, args.digits)
+        })
+        follower_display.CARD_API_URL = f'http://127.0.0.1:{card_server.server_port}/x/web-interface/card'
+        follower_display.config['batch_api_url'] = f'http://127.0.0.1:{card_server.server_port}/x/relation/stats'
+        follower_display.shutdown_fetch_executor()
+
+        threads_before = threading.active_count()
+        with ThreadSampler() as sampler:
+            fetch = bench_fetch(args.boards)
+            full = bench_redraw(server, args.digits, False, args.delay, args.time_scale)
+            incremental = bench_redraw(server, args.digits, True, args.delay, args.time_scale)
+
+        print(f"显示板 {args.boards} 个 × {args.digits} 位，命令间隔 {args.delay}s（缩放 {args.time_scale}），"
+              f"接口延迟 {args.latency * 1000:.0f}ms，错误率 {args.error_rate:.0%}，"
+              f"{'共用假人' if args.shared_bot else '独立假人'}，并发 {args.concurrency}，显示方式 {args.render_backend}")
+        print(f"查询（{args.backend}）: {fetch['requests']} 个MID，HTTP 请求 {fetch['http_requests']} 次，"
+              f"用时 {fetch['seconds']:.3f}s，{fetch['throughput']:.1f} 个MID/秒，失败 {fetch['failures']}")
+        for label, result in (('完整重绘', full), ('+1 增量重绘', incremental)):
+            print(f"{label}: {result['commands']} 条命令（每板 {result['commands_per_redraw']:.1f} 条），"
+                  f"实际 {result['seconds']:.3f}s，换算 {result['virtual_seconds']:.1f}s"
+                  f"（逐条串行需 {result['serial_virtual_seconds']:.1f}s）")
+        print(f"线程数: 开始 {threads_before}，峰值 {sampler.peak}（其中插件线程 {sampler.plugin_peak}，其余为模拟接口）")
+        stats = follower_display.get_metrics()['histograms'].get('render_queue_seconds')
+        if stats:
+            print(f"排队等待: 平均 {stats['avg'] / args.time_scale:.1f}s，最大 {stats['max'] / args.time_scale:.1f}s（换算）")
+    finally:
+        follower_display.on_unload(server)
+        card_server.shutdown()
+        server.cleanup()
+
+
+if __name__ == '__main__':
+    main()
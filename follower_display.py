@@ -34,10 +34,23 @@ Author: 通义千问/小豆(DeepSeek/呜楠二改)
 }
 """
 
-import requests
 import threading
 import json
 import os
+import time
+import asyncio
+import contextlib
+import contextvars
+import functools
+import cProfile
+import pstats
+import itertools
+import hashlib
+import mmap
+import re
+import struct
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from mcdreforged.api.all import *
 
 # 插件元数据
@@ -53,7 +66,59 @@ PLUGIN_METADATA = {
 config = {
     'log_enabled': True,       # 是否启用详细日志
     'auto_start': False,         # 服务器启动时是否自动开启定时更新
-    'update_interval': 60,      # 自动更新间隔（不可用）
+    'update_interval': 60,      # 自动更新的初始间隔（秒），之后按各 MID 的变化频率自适应调整
+    'poll_min_interval': 10,    # 自适应轮询的最短间隔（秒）
+    'poll_max_interval': 600,   # 自适应轮询的最长间隔（秒）
+    'poll_backoff': 1.5,        # 粉丝数无变化时轮询间隔的增长倍数
+    'max_requests_per_minute': 60, # 定时更新每分钟最多发出的查询数
+    'fetch_workers': 8,         # 批量查询粉丝数时的最大并发数
+    'http_pool_size': 10,       # HTTP 连接池大小（保持长连接）
+    'http_timeout': 10,         # 单次请求超时（秒）
+    'http_retries': 2,          # 连接失败/5xx 时的重试次数
+    'http_backoff_factor': 0.5, # 重试退避系数（秒）
+    'rate_limit_per_second': 2, # 每秒最多向B站发出的请求数（令牌桶平均速率），0 为不限制
+    'rate_limit_burst': 5,      # 令牌桶容量（允许短时间内连续发出的请求数）
+    'risk_backoff': 60,         # 触发风控（-412/-799/HTTP 412/429）且未给出 Retry-After 时暂停所有请求的时间（秒），连续触发时加倍
+    'circuit_failure_threshold': 3, # 同一 MID 连续查询失败多少次后暂停查询该 MID
+    'circuit_open_seconds': 60, # MID 暂停查询的初始时长（秒），恢复后再次失败时加倍
+    'circuit_max_open_seconds': 1800, # 暂停时长上限（秒）
+    'fetch_backend': 'card',    # 粉丝数查询方式：card 每个 MID 单独请求；batch 通过批量接口一次查询多个 MID（失败或缺少名称时回退到 card）
+    'batch_api_url': 'https://api.bilibili.com/x/relation/stats', # batch 模式使用的批量粉丝数接口
+    'batch_api_param': 'mids',  # 批量接口传入 MID 列表（逗号分隔）的参数名
+    'batch_size': 20,           # 每次批量请求最多包含的 MID 数
+    'follower_cache_ttl': 10,   # 粉丝数查询结果的缓存有效期（秒），0 为不缓存
+    'follower_cache_size': 256, # 粉丝数查询缓存最多保存的 MID 数
+    'cache_flush_delay': 5,     # 粉丝数缓存变更后延迟写入文件的时间（秒）
+    'history_enabled': True,    # 是否记录各 MID 的粉丝数历史（数据目录下 history/）
+    'history_min_interval': 10, # 同一 MID 两条历史记录的最短间隔（秒）
+    'history_max_bytes': 4194304, # 单个 MID 原始记录文件的大小上限（字节，每条 8 字节），超过后较早的一半降采样归档
+    'history_downsample_step': 3600, # 归档记录的降采样间隔（秒）
+    'history_archive_max_bytes': 1048576, # 单个 MID 归档文件的大小上限（字节），超过后丢弃最早的一半
+    'history_mmap': True,       # 查询历史时使用 mmap 读取文件
+    'max_concurrent_renders': 4, # 最多同时进行显示的假人数（同一假人的显示板始终依次显示）
+    'keep_bot_alive': False,    # 显示完成后保留假人，下次显示时省去 spawn/kill
+    'render_backend': 'commands', # 显示方式：commands 逐条发送假人命令；datapack 通过各显示板固定的数据包函数，用一条 /function 传入本次重绘的步骤（需 1.20.2 及以上）；
+                                  # blocks 不使用假人，按 digit_positions 直接修改告示牌/文本展示实体/方块（显示板中可单独设置）
+    'datapack_path': '',        # datapack 模式写入的数据包目录（如 server/world/datapacks/bfan），为空时回退到逐条发送
+    'datapack_namespace': 'bfan', # 生成的函数所在的命名空间
+    'datapack_pack_format': 18, # 生成 pack.mcmeta 时使用的 pack_format（需 18 及以上以支持函数宏，45 及以上使用 1.21 的 function 目录）
+    'datapack_reload_delay': 1.0, # 数据包函数有变更时等待 /reload 完成的时间（秒），开启 RCON 时为重载后重试 /function 的最长时间
+    'sign_text_format': 'json', # blocks 显示方式写入文本的格式：json（1.20~1.21.4）、snbt（1.21.5 及以上）、legacy（1.20 以前的 Text1）
+    'glyph_mode': 'sign',       # blocks 显示方式每一位的显示载体：sign 告示牌、text_display 文本展示实体、block 方块点阵（显示板中可单独设置）
+    'glyph_direction': 'x',     # block 点阵从左到右延伸的方向：x、-x、z、-z（显示板中可单独设置）
+    'glyph_block': 'minecraft:white_concrete', # block 点阵的字形方块（显示板中可单独设置）
+    'glyph_background': 'minecraft:air', # block 点阵的背景方块（显示板中可单独设置）
+    'adaptive_delay': False,    # 根据 RCON 命令完成耗时自动调整命令间隔（需开启 RCON）
+    'adaptive_delay_min': 0.2,  # 自适应间隔下限（秒）
+    'adaptive_delay_max': 3.0,  # 自适应间隔上限（秒）
+    'adaptive_lag_threshold': 0.15, # 命令完成耗时超过该值（秒）视为服务端卡顿
+    'metrics_export': False,    # 是否定期将运行指标导出为 Prometheus 文本（数据目录下 metrics.prom）
+    'metrics_export_interval': 60, # 指标导出周期（秒）
+    'update_mode': 'all',       # 定时更新模式：all 每次都重绘，changed 仅重绘粉丝数有变化的显示板
+    'event_debounce': 30,       # 同一显示板粉丝数变化事件的最短派发间隔（秒），期间的变化合并为一次
+    'milestone_step': 10000,    # 粉丝数越过该值的整数倍时派发 milestone 事件，0 为不按整数倍
+    'milestones': [],           # 额外的里程碑数值
+    'config_watch_interval': 5, # 检查配置文件修改时间的周期（秒），文件变更后自动重载，0 为不检查
     'displays': [              # 显示板配置列表
         {
             'name': 'main',    # 显示板名称
@@ -73,21 +138,902 @@ config = {
             },
             'reset_pos': '-2466 197 -947',  # 复位位置
             'spawn_pos': '-2464 198 -945',  # 假人生成位置
+            'bot_name': 'Fan',              # 使用的假人名称，不同假人的显示板可同时显示
+            'optimize_digit_order': False,  # 按最短转向顺序敲击（仅适用于与敲击顺序无关的显示装置）
+            'min_delta': 1,                 # changed 模式下粉丝数变化至少达到该值才重绘
+            'min_redraw_interval': 0,       # changed 模式下两次重绘的最短间隔（秒）
             'delay_between_commands': 1.0   # 每个动作间隔（秒）
         }
     ]
 }
 
+# 定时更新的轮询检查周期（秒）
+POLL_TICK = 1.0
+
+# 默认假人名称
+DEFAULT_BOT_NAME = 'Fan'
+
 # 缓存文件名
 CACHE_FILE = 'fan_cache.json'
 
+# 插件加载时等待缓存文件载入的最长时间（秒）
+CACHE_READY_TIMEOUT = 5
+
+# 加载时逐条输出的显示板数量上限
+STARTUP_DISPLAY_LOG_LIMIT = 10
+
+# Prometheus 指标导出文件名
+METRICS_FILE = 'metrics.prom'
+
+# 粉丝数历史记录目录
+HISTORY_DIR = 'history'
+
+# !!fan history 默认查询的小时数及输出的行数
+HISTORY_DEFAULT_HOURS = 24
+HISTORY_COMMAND_POINTS = 12
+# get_history 未指定降采样间隔时，按查询范围自动选择间隔使返回的记录不超过该条数
+HISTORY_MAX_POINTS = 10000
+
+# 配置文件名
+CONFIG_FILE = 'bfanconfig.json'
+
+# 性能追踪：单次追踪最多记录的区间数、cProfile 摘要输出的行数
+TRACE_MAX_EVENTS = 200000
+TRACE_PROFILE_LINES = 60
+# 不属于某个线程的区间（如跨越多个线程的更新轮次）显示在这些虚拟轨道上 {轨道名: tid}
+TRACE_TRACKS = {'更新轮次': 1, '显示排队': 2}
+
+# 热重载时各全局配置项变更后需要重建的组件
+HTTP_CONFIG_KEYS = ('fetch_workers', 'http_pool_size', 'http_timeout', 'http_retries', 'http_backoff_factor')
+RATE_LIMIT_CONFIG_KEYS = ('rate_limit_per_second', 'rate_limit_burst')
+FOLLOWER_CACHE_CONFIG_KEYS = ('follower_cache_ttl', 'follower_cache_size')
+POLL_CONFIG_KEYS = ('poll_min_interval', 'poll_max_interval')
+METRICS_CONFIG_KEYS = ('metrics_export', 'metrics_export_interval')
+
+# 显示板的这些字段变更后，进行中的显示任务作废
+DISPLAY_RENDER_KEYS = ('digit_look_at', 'reset_pos', 'spawn_pos', 'bot_name', 'render_backend',
+                       'digit_positions', 'glyph_mode', 'glyph_direction', 'glyph_block', 'glyph_background')
+# 显示板的这些字段变更后，屏幕上的内容与缓存不再对应，下次显示时完整重绘
+DISPLAY_LAYOUT_KEYS = ('digit_look_at', 'reset_pos', 'render_backend', 'digit_positions', 'glyph_mode', 'glyph_direction',
+                       'glyph_block', 'glyph_background')
+# 这些全局字段变更后，未在显示板中单独设置的显示板同样视为显示方式/布局变化（sign_text_format 只有全局设置）
+GLOBAL_LAYOUT_KEYS = ('render_backend', 'sign_text_format', 'glyph_mode', 'glyph_direction', 'glyph_block', 'glyph_background')
+
+# 每秒游戏刻数，用于将命令间隔换算为 schedule 的延迟
+TICKS_PER_SECOND = 20
+
+# datapack 显示方式使用函数宏，需要 1.20.2（pack_format 18）及以上
+DATAPACK_MACRO_PACK_FORMAT = 18
+# 通过 RCON 触发 /function 时，返回内容包含这些文字视为失败（函数不存在、宏参数错误等）
+DATAPACK_TRIGGER_ERRORS = ('Unknown', 'Incorrect', 'Expected', 'Invalid', 'could not', 'Failed', "Can't")
+# 游戏内的步骤未按预计时间执行完（服务端低于 20 TPS）时，最多再等待预计时间的多少倍
+DATAPACK_MAX_WAIT_FACTOR = 5
+# 开启 RCON 时 /reload 在服务端异步完成，函数尚未载入时重试 /function 的间隔（秒）
+DATAPACK_RELOAD_RETRY_INTERVAL = 0.25
+# 函数文件未变更时连续触发失败达到该次数后，该显示板在配置变更前不再使用数据包
+DATAPACK_MAX_TRIGGER_FAILURES = 3
+
+# blocks 显示方式中 glyph_mode 为 block 时使用的 3×5 点阵字形（从上到下每行 3 格，1 为字形方块）
+DIGIT_GLYPHS = {
+    '0': ('111', '101', '101', '101', '111'),
+    '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'),
+    '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'),
+    '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'),
+    '7': ('111', '001', '001', '001', '001'),
+    '8': ('111', '101', '111', '101', '111'),
+    '9': ('111', '101', '111', '001', '111'),
+    ' ': ('000', '000', '000', '000', '000')
+}
+
+# 点阵字形从左到右延伸的方向
+GLYPH_DIRECTIONS = {'x': (1, 0), '-x': (-1, 0), 'z': (0, 1), '-z': (0, -1)}
+
+# 全局配置中缺少字形设置时使用的默认值
+DEFAULT_GLYPH_OPTIONS = {
+    'glyph_mode': 'sign',
+    'glyph_direction': 'x',
+    'glyph_block': 'minecraft:white_concrete',
+    'glyph_background': 'minecraft:air'
+}
+
+# B站接口
+CARD_API_URL = 'https://api.bilibili.com/x/web-interface/card'
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# B站风控返回码（-412 请求被拦截，-799 请求过于频繁）及对应的 HTTP 状态码
+RISK_CONTROL_CODES = (-412, -799)
+RISK_CONTROL_HTTP_STATUS = (412, 429)
+
 # 全局变量
-update_timer = None
+update_timer = None  # 定时轮询协程的 Future
 server_inst = None  # 保存 MCDR server 实例
 plugin_instances = {}  # 存储插件实例供API调用
-is_updating = False  # 标记是否正在更新
-current_update_index = 0  # 当前更新的显示板索引
 scheduler_running = False  # 标记定时任务是否正在运行
+poll_states = {}  # 各 MID 的轮询状态 {mid: {'interval', 'next_due', 'last_fans', 'polls', 'changes', 'failures'}}
+polling_mids = set()  # 正在查询/显示中的 MID
+poll_request_times = deque()  # 最近一分钟内发出查询的时间，用于请求预算
+poll_generation = 0  # 每次启停定时任务时递增，用于丢弃过期的回调
+poll_cycle_ids = itertools.count(1)  # 定时更新轮次编号，用于性能追踪
+poll_lock = threading.Lock()
+running_commands = set()  # 正在后台执行的命令标识
+metrics_export_timer = None  # 指标定时导出任务的 TaskHandle
+running_commands_lock = threading.Lock()
+config_save_lock = threading.Lock()
+fetch_executor = None  # 批量查询使用的线程池
+http_session = None  # 复用连接的 HTTP 会话
+http_session_lock = threading.Lock()
+rate_limiter = None  # 向B站发出请求的令牌桶，None 时按配置创建
+rate_limiter_lock = threading.Lock()
+throttle_until = 0.0  # 触发风控后暂停所有请求直到该时间（time.monotonic()）
+throttle_streak = 0  # 连续触发风控的次数，用于加倍退避时间
+circuit_states = {}  # 各 MID 的熔断状态 {mid: {'failures', 'opens', 'open_until', 'last_data'}}
+throttle_lock = threading.Lock()
+follower_cache = OrderedDict()  # 粉丝数查询缓存 {mid: (时间戳, data)}，按 LRU 排序
+follower_inflight = {}  # 正在进行中的查询 {mid: {'event': Event, 'result': data}}
+follower_cache_lock = threading.Lock()
+follower_cache_stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+fan_cache = {}  # 各显示板当前显示的粉丝数 {display_name: fans}
+fan_cache_lock = threading.Lock()
+fan_cache_io_lock = threading.Lock()  # 保证同一时间只有一个写文件操作
+fan_cache_dirty = False  # 内存缓存是否有未写入文件的修改
+fan_cache_flush_timer = None  # 延迟写入任务的 TaskHandle
+fan_cache_ready = threading.Event()  # 缓存文件是否已载入内存
+active_renders = {}  # 排队中及正在进行的显示任务 {任务ID: job}
+render_lanes = {}  # 每个假人的待显示队列 {bot_name: deque([job, ...])}
+busy_bots = set()  # 正在显示中的假人
+alive_bots = {}  # 已生成且未清理的假人 {bot_name: spawn_pos}
+command_delays = {}  # 自适应模式下各显示板当前的命令间隔 {display_name: 秒}
+datapack_failures = {}  # 数据包函数连续触发失败的显示板 {函数目录名: (失败次数, 函数内容签名)}
+datapack_lock = threading.Lock()
+last_redraw_times = {}  # 定时更新中各显示板最近一次重绘的时间 {display_name: time.monotonic()}
+render_ids = itertools.count(1)
+render_lock = threading.Lock()
+display_index = {}  # 显示板名称索引 {name: display}
+mid_index = {}  # MID 索引 {mid: [display, ...]}，按配置顺序
+indexed_displays = None  # 建立索引时的 config['displays'] 列表，用于发现整体替换
+display_index_lock = threading.Lock()
+config_mtime = None  # 最近一次读取/写入配置文件时的修改时间
+pending_config_mtime = None  # 检测到但尚未确认写入完成的修改时间
+config_watch_timer = None  # 配置文件检查任务的 TaskHandle
+config_reload_lock = threading.RLock()
+event_states = {}  # 各显示板的事件状态 {display_name: {'reported', 'latest', 'mid', 'last_emit', 'timer', 'failing', 'last_failure'}}
+event_lock = threading.Lock()
+
+# ===== 后台引擎 =====
+
+class TaskHandle:
+    """延时任务句柄，可用于取消尚未执行的任务"""
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """取消任务（已开始执行的任务不受影响）"""
+        self.cancelled = True
+
+
+class AsyncEngine:
+    """
+    后台 asyncio 事件循环
+    显示命令的节奏控制、定时轮询都以协程形式在同一个线程中运行，不随显示板数量增加线程；
+    阻塞操作（HTTP 请求、RCON、文件读写）交给固定大小的工作线程池
+    """
+
+    def __init__(self, workers=4):
+        self._workers = workers
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    def start(self):
+        """启动事件循环线程"""
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='BFanWorker')
+            loop.set_default_executor(self._executor)
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+                # 取消所有未完成的协程后关闭事件循环
+                tasks = asyncio.all_tasks(loop)
+                for task in tasks:
+                    task.cancel()
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                loop.close()
+
+            self._thread = threading.Thread(target=run, name='BFanEngine', daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+
+    def stop(self):
+        """停止事件循环，未完成的协程和延时任务全部取消"""
+        with self._lock:
+            loop, thread, executor = self._loop, self._thread, self._executor
+            self._loop = self._thread = self._executor = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not threading.current_thread():
+            thread.join(timeout=5)
+        executor.shutdown(wait=False)
+
+    def submit(self, coro):
+        """
+        在事件循环中运行协程（可从任意线程调用）
+        :return: concurrent.futures.Future，可调用 cancel() 取消协程；引擎未运行时返回 None
+        """
+        loop = self._loop
+        if loop is None:
+            coro.close()
+            return None
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def call_later(self, delay, func, *args):
+        """
+        延迟执行函数（在事件循环线程中执行，函数本身不应阻塞）
+        :param delay: 延迟时间（秒）
+        :return: TaskHandle
+        """
+        handle = TaskHandle(func, args)
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.call_later, max(0.0, delay), self._fire, handle)
+        return handle
+
+    def run_in_background(self, func, *args):
+        """在工作线程池中执行可能阻塞的函数"""
+        return self.submit(self.run_blocking(func, *args))
+
+    async def run_blocking(self, func, *args):
+        """在协程中等待工作线程池执行阻塞函数，返回其结果"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._invoke, func, args)
+
+    def _fire(self, handle):
+        if not handle.cancelled:
+            self._invoke(handle.func, handle.args)
+
+    @staticmethod
+    def _invoke(func, args):
+        try:
+            return func(*args)
+        except Exception as e:
+            log_info(f"后台任务执行失败: {e}")
+
+
+engine = AsyncEngine()
+
+# ===== 指标统计 =====
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': cumulative
+        }
+
+
+class MetricsRegistry:
+    """插件内部指标：计数器与耗时直方图"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1):
+        """计数器加值"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        """记录一次观测值（耗时单位为秒）"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+        获取当前所有指标
+        :return: {'counters': {name: value}, 'histograms': {name: {'count', 'sum', 'avg', 'max', 'buckets'}}}
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {name: h.snapshot() for name, h in self._histograms.items()}
+            }
+
+    def to_prometheus(self, prefix='bfan_'):
+        """导出为 Prometheus 文本格式"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE {prefix}{name} counter")
+            lines.append(f"{prefix}{name} {value}")
+        for name, data in sorted(snapshot['histograms'].items()):
+            lines.append(f"# TYPE {prefix}{name} histogram")
+            for bound, count in data['buckets']:
+                lines.append(f'{prefix}{name}_bucket{{le="{bound:g}"}} {count}')
+            lines.append(f'{prefix}{name}_bucket{{le="+Inf"}} {data["count"]}')
+            lines.append(f"{prefix}{name}_sum {data['sum']}")
+            lines.append(f"{prefix}{name}_count {data['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# ===== 性能追踪 =====
+
+class Tracer:
+    """
+    性能追踪：记录各阶段的耗时区间，导出为 Chrome Trace 格式（chrome://tracing 或 Perfetto 可直接打开）
+    未开启时 span() 返回空的上下文管理器，不产生额外开销
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = {}  # {线程ID: 线程名}，导出时生成线程名元数据
+        self._origin = 0.0
+        self.enabled = False
+        self.started_at = None  # 开始追踪的时间（time.time()）
+        self.dropped = 0
+        self.max_events = TRACE_MAX_EVENTS
+        # cProfile 采集状态
+        self._profile_path = None  # 等待采集时为输出路径前缀
+        self._profile_cycle = None  # 正在采集的轮次
+        self._profiles = []
+        self._profile_local = threading.local()
+        self._profile_active = 0  # 仍处于启用状态的线程数
+        self._profile_finishing = False
+
+    def start(self, max_events=TRACE_MAX_EVENTS):
+        """清空已记录的数据并开始追踪，已在追踪时返回 False"""
+        with self._lock:
+            if self.enabled:
+                return False
+            self._events = []
+            self._threads = {}
+            self._origin = time.perf_counter()
+            self.started_at = time.time()
+            self.dropped = 0
+            self.max_events = max(1, int(max_events))
+            self.enabled = True
+            return True
+
+    def stop(self):
+        """
+        停止追踪
+        :return: Chrome Trace 数据 {'traceEvents': [...], ...}，未在追踪时为 None
+        """
+        with self._lock:
+            if not self.enabled:
+                return None
+            self.enabled = False
+            events, threads = self._events, self._threads
+            self._events, self._threads = [], {}
+        pid = os.getpid()
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                    for tid, name in threads.items()]
+        return {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'plugin': PLUGIN_METADATA['id'], 'started_at': self.started_at, 'dropped': self.dropped}
+        }
+
+    def record(self, name, start, end, args=None, track=None):
+        """
+        记录一个已结束的区间
+        :param start: 开始时间（time.perf_counter()）
+        :param end: 结束时间（time.perf_counter()）
+        :param track: 显示在指定的轨道（线程名），None 时使用当前线程
+        """
+        if not self.enabled:
+            return
+        if track is None:
+            thread = threading.current_thread()
+            tid, track = thread.ident, thread.name
+        else:
+            tid = TRACE_TRACKS.get(track, 0)
+        with self._lock:
+            if not self.enabled:
+                return
+            if len(self._events) >= self.max_events:
+                self.dropped += 1
+                return
+            self._threads.setdefault(tid, track)
+            self._events.append({
+                'name': name,
+                'cat': 'bfan',
+                'ph': 'X',
+                'ts': round(max(0.0, start - self._origin) * 1e6, 1),
+                'dur': round(max(0.0, end - start) * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': args or {}
+            })
+
+    @contextlib.contextmanager
+    def _span(self, name, args):
+        args = {**trace_context.get(), **args}
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(name, start, time.perf_counter(), args)
+
+    def span(self, name, **args):
+        """
+        记录 with 语句块的耗时（可跨越 await），块内可向返回的 args 字典补充参数
+        用法: with tracer.span('http', mid=mid) as args: ...
+        """
+        if not self.enabled:
+            return contextlib.nullcontext({})
+        return self._span(name, args)
+
+    @contextlib.contextmanager
+    def _context(self, args):
+        token = trace_context.set({**trace_context.get(), **args})
+        try:
+            yield
+        finally:
+            trace_context.reset(token)
+
+    def context(self, **args):
+        """with 语句块内记录的区间都附加这些参数（如轮次、MID），提交到线程池的函数需经 bind 继承"""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._context(args)
+
+    def bind(self, func):
+        """追踪进行中时，让 func 在线程池中执行时继承当前 context() 设置的参数"""
+        if not self.enabled:
+            return func
+        return functools.partial(contextvars.copy_context().run, func)
+
+    def request_profile(self, path):
+        """
+        下一轮定时更新时使用 cProfile 采集
+        :param path: 输出文件路径前缀，生成 .prof（pstats 格式）和 .txt（按累计耗时排序的摘要）
+        :return: 是否已安排（已有采集在等待或进行中时为 False）
+        """
+        with self._lock:
+            if self._profile_path is not None:
+                return False
+            self._profile_path = path
+            return True
+
+    def begin_profile(self, cycle):
+        """定时更新轮次开始时调用，有等待中的采集请求时由该轮次认领"""
+        with self._lock:
+            if self._profile_path is None or self._profile_cycle is not None:
+                return False
+            self._profile_cycle = cycle
+            self._profiles = []
+            self._profile_finishing = False
+            return True
+
+    @contextlib.contextmanager
+    def _profiled(self):
+        local = self._profile_local
+        depth = getattr(local, 'depth', 0)
+        if depth == 0:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12 起同一时间只能启用一个分析器，它已覆盖所有线程
+                yield
+                return
+            with self._lock:
+                self._profiles.append(profile)
+                self._profile_active += 1
+            local.profile = profile
+        local.depth = depth + 1
+        try:
+            yield
+        finally:
+            local.depth -= 1
+            if local.depth == 0:
+                local.profile.disable()
+                local.profile = None
+                with self._lock:
+                    self._profile_active -= 1
+                    ready = self._profile_finishing and self._profile_active == 0
+                if ready:
+                    self._write_profile()
+
+    def profiled(self):
+        """采集进行中时，在当前线程启用 cProfile 直到 with 语句块结束（可嵌套）"""
+        if self._profile_cycle is None and not getattr(self._profile_local, 'depth', 0):
+            return contextlib.nullcontext()
+        return self._profiled()
+
+    def end_profile(self, cycle):
+        """定时更新轮次结束时调用，各线程的分析器都停止后写出结果"""
+        with self._lock:
+            if self._profile_cycle != cycle:
+                return
+            self._profile_cycle = None
+            self._profile_finishing = True
+            ready = self._profile_active == 0
+        if ready:
+            self._write_profile()
+
+    def _write_profile(self):
+        with self._lock:
+            if not self._profile_finishing:
+                return
+            self._profile_finishing = False
+            profiles, self._profiles = self._profiles, []
+            path, self._profile_path = self._profile_path, None
+        if profiles:
+            engine.run_in_background(write_profile_stats, profiles, path)
+
+    def cancel_profile(self):
+        """放弃等待中或进行中的采集"""
+        with self._lock:
+            self._profile_path = None
+            self._profile_cycle = None
+            self._profile_finishing = False
+            self._profiles = []
+
+    def get_status(self):
+        """
+        获取追踪状态
+        :return: {'enabled', 'events', 'dropped', 'seconds', 'profile'}，profile 为 None/'pending'/'running'
+        """
+        with self._lock:
+            if self._profile_cycle is not None or self._profile_finishing:
+                profile = 'running'
+            else:
+                profile = 'pending' if self._profile_path is not None else None
+            return {
+                'enabled': self.enabled,
+                'events': len(self._events),
+                'dropped': self.dropped,
+                'seconds': time.perf_counter() - self._origin if self.enabled else 0.0,
+                'profile': profile
+            }
+
+
+def write_profile_stats(profiles, path):
+    """合并各线程的 cProfile 结果，写出 .prof 文件和文本摘要"""
+    try:
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path + '.prof')
+        with open(path + '.txt', 'w', encoding='utf-8') as f:
+            stats.stream = f
+            stats.sort_stats('cumulative').print_stats(TRACE_PROFILE_LINES)
+    except Exception as e:
+        log_info(f"性能分析结果写入失败: {e}")
+        return
+    log_info(f"性能分析结果已写入 {path}.prof（{len(profiles)} 个线程）")
+
+
+trace_context = contextvars.ContextVar('bfan_trace_context', default={})  # 当前协程/线程附加到追踪区间的参数
+tracer = Tracer()
+
+# ===== 请求限流 =====
+
+class TokenBucket:
+    """令牌桶限流器：平均每秒补充 rate 个令牌，最多积攒 burst 个"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """
+        取得一个令牌，令牌不足时等待
+        :param timeout: 最长等待时间（秒），None 表示一直等待
+        :return: 是否取得令牌
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+# ===== 历史记录 =====
+
+class HistoryStore:
+    """
+    按 MID 保存粉丝数历史的追加写入存储
+    每条记录为定长 8 字节（时间戳 uint32 + 粉丝数 uint32），按时间顺序追加到 <mid>.bin；
+    原始文件超过 history_max_bytes 时，较早的一半按 history_downsample_step 降采样后移入 <mid>.archive.bin，
+    归档文件超过 history_archive_max_bytes 时丢弃最早的一半。
+    查询时二分查找起始位置后顺序读取，不会把整个文件读入内存
+    """
+
+    RECORD = struct.Struct('<II')
+    CHUNK_RECORDS = 4096
+
+    def __init__(self):
+        self.folder = None
+        self._lock = threading.Lock()
+        self._last_times = {}  # {mid: 最近一条记录的时间戳}
+
+    def open(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            self.folder = folder
+            self._last_times.clear()
+
+    def close(self):
+        with self._lock:
+            self.folder = None
+            self._last_times.clear()
+
+    def _path(self, mid, archive=False):
+        return os.path.join(self.folder, f"{mid}.archive.bin" if archive else f"{mid}.bin")
+
+    def _last_time(self, path):
+        """读取文件中最后一条记录的时间戳"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell() - f.tell() % self.RECORD.size
+                if size == 0:
+                    return None
+                f.seek(size - self.RECORD.size)
+                return self.RECORD.unpack(f.read(self.RECORD.size))[0]
+        except FileNotFoundError:
+            return None
+
+    def append(self, mid, timestamp, fans):
+        """
+        追加一条记录（距上一条不足 history_min_interval 秒时忽略）
+        :return: 原始文件是否已超过大小上限，需要调用 compact
+        """
+        mid = str(mid)
+        timestamp = int(timestamp)
+        with self._lock:
+            if self.folder is None:
+                return False
+            path = self._path(mid)
+            last = self._last_times.get(mid)
+            if last is None:
+                last = self._last_time(path)
+            if last is not None and timestamp - last < float(config.get('history_min_interval', 10)):
+                return False
+            with open(path, 'ab') as f:
+                f.write(self.RECORD.pack(timestamp, max(0, min(int(fans), 0xFFFFFFFF))))
+                size = f.tell()
+            self._last_times[mid] = timestamp
+        return size > int(config.get('history_max_bytes', 4 * 1024 * 1024))
+
+    def _read_at(self, source, index):
+        if isinstance(source, mmap.mmap):
+            return self.RECORD.unpack_from(source, index * self.RECORD.size)
+        source.seek(index * self.RECORD.size)
+        return self.RECORD.unpack(source.read(self.RECORD.size))
+
+    def _bisect(self, source, count, timestamp):
+        """二分查找第一条不早于 timestamp 的记录序号"""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._read_at(source, middle)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _edge_record(self, path, since, until, last=False):
+        """读取一个文件中时间范围内的第一条（last 为 True 时为最后一条）记录，没有时返回 None"""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            count = os.fstat(f.fileno()).st_size // self.RECORD.size
+            index = self._bisect(f, count, until + 1) - 1 if last else self._bisect(f, count, since)
+            if not 0 <= index < count:
+                return None
+            record = self._read_at(f, index)
+        return record if since <= record[0] <= until else None
+
+    def _iter_file(self, path, since, until):
+        """按时间范围顺序读取一个文件中的记录"""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            count = os.fstat(f.fileno()).st_size // self.RECORD.size
+            if count == 0:
+                return
+            source = f
+            if config.get('history_mmap', True):
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                index = self._bisect(source, count, since)
+                while index < count:
+                    batch = min(self.CHUNK_RECORDS, count - index)
+                    if isinstance(source, mmap.mmap):
+                        data = source[index * self.RECORD.size:(index + batch) * self.RECORD.size]
+                    else:
+                        source.seek(index * self.RECORD.size)
+                        data = source.read(batch * self.RECORD.size)
+                    for timestamp, fans in self.RECORD.iter_unpack(data):
+                        if timestamp > until:
+                            return
+                        yield timestamp, fans
+                    index += batch
+            finally:
+                if source is not f:
+                    source.close()
+
+    def query(self, mid, since=0, until=None, step=0):
+        """
+        查询一个 MID 的历史（归档与原始记录合并）
+        :param since: 起始时间戳（含）
+        :param until: 结束时间戳（含），None 表示到最新
+        :param step: 降采样间隔（秒），每个间隔取最后一条记录，0 表示返回原始记录
+        :return: [(时间戳, 粉丝数), ...]
+        """
+        mid = str(mid)
+        until = 0xFFFFFFFF if until is None else int(until)
+        since = max(0, int(since))
+        points = []
+        last_bucket = None
+        newest = -1
+        # 持有锁读取，避免与 compact 替换文件同时进行（Windows 下已打开的文件无法被替换）
+        with self._lock:
+            if self.folder is None:
+                return []
+            for path in (self._path(mid, archive=True), self._path(mid)):
+                for timestamp, fans in self._iter_file(path, since, until):
+                    if timestamp <= newest:
+                        continue  # 归档与原始记录的重叠部分
+                    newest = timestamp
+                    if step > 0:
+                        bucket = timestamp // step
+                        if bucket == last_bucket:
+                            points[-1] = (timestamp, fans)
+                            continue
+                        last_bucket = bucket
+                    points.append((timestamp, fans))
+        return points
+
+    def endpoints(self, mid, since=0, until=None):
+        """
+        获取一个 MID 在时间范围内最早和最新的原始记录（只读取两端，不受降采样影响）
+        :return: ((时间戳, 粉丝数), (时间戳, 粉丝数))，范围内没有记录时返回 None
+        """
+        mid = str(mid)
+        until = 0xFFFFFFFF if until is None else int(until)
+        since = max(0, int(since))
+        with self._lock:
+            if self.folder is None:
+                return None
+            archive_path, path = self._path(mid, archive=True), self._path(mid)
+            first = self._edge_record(archive_path, since, until) or self._edge_record(path, since, until)
+            last = (self._edge_record(path, since, until, last=True)
+                    or self._edge_record(archive_path, since, until, last=True))
+        return (first, last) if first is not None else None
+
+    def _copy_records(self, source_path, target, start, end, step=0):
+        """将 source_path 中第 start~end 条记录（按 step 降采样）写入已打开的 target"""
+        last = None
+        with open(source_path, 'rb') as f:
+            f.seek(start * self.RECORD.size)
+            index = start
+            while index < end:
+                batch = min(self.CHUNK_RECORDS, end - index)
+                data = f.read(batch * self.RECORD.size)
+                if step > 0:
+                    out = bytearray()
+                    for timestamp, fans in self.RECORD.iter_unpack(data):
+                        if last is not None and timestamp // step != last[0] // step:
+                            out += self.RECORD.pack(*last)
+                        last = (timestamp, fans)
+                    target.write(out)
+                else:
+                    target.write(data)
+                index += batch
+        if step > 0 and last is not None:
+            target.write(self.RECORD.pack(*last))
+
+    def _rewrite_tail(self, path, keep_from, count):
+        """只保留文件中从 keep_from 开始的记录"""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as target:
+            self._copy_records(path, target, keep_from, count)
+        os.replace(temp_path, path)
+
+    def compact(self, mid):
+        """将原始记录较早的一半降采样移入归档，并按大小上限裁剪归档"""
+        mid = str(mid)
+        with self._lock:
+            if self.folder is None:
+                return
+            path = self._path(mid)
+            archive_path = self._path(mid, archive=True)
+            count = os.path.getsize(path) // self.RECORD.size
+            split = count // 2
+            if split == 0:
+                return
+            step = max(1, int(config.get('history_downsample_step', 3600)))
+            with open(archive_path, 'ab') as archive:
+                self._copy_records(path, archive, 0, split, step)
+            self._rewrite_tail(path, split, count)
+
+            archive_count = os.path.getsize(archive_path) // self.RECORD.size
+            if archive_count * self.RECORD.size > int(config.get('history_archive_max_bytes', 1024 * 1024)):
+                self._rewrite_tail(archive_path, archive_count // 2, archive_count)
+        metrics.inc('history_compactions_total')
+
+
+history = HistoryStore()
 
 # ===== 工具函数 =====
 
@@ -101,153 +1047,1584 @@ def log_debug(msg):
     if server_inst and config['log_enabled']:
         server_inst.logger.debug(f"[Bilibili] {msg}")
 
-def get_follower_count(mid):
-    """获取B站粉丝数"""
-    url = f"https://api.bilibili.com/x/web-interface/card?mid={mid}"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    }
+def get_http_session():
+    """获取（必要时创建）带连接池和重试的 HTTP 会话"""
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            # 延迟导入 requests，加快插件加载
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            pool_size = max(1, int(config.get('http_pool_size', 10)))
+            retry = Retry(
+                total=max(0, int(config.get('http_retries', 2))),
+                backoff_factor=float(config.get('http_backoff_factor', 0.5)),
+                status_forcelist=(500, 502, 503, 504)
+            )
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.headers.update(HTTP_HEADERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            http_session = session
+        return http_session
+
+def close_http_session():
+    """关闭 HTTP 会话，释放连接池"""
+    global http_session
+    with http_session_lock:
+        if http_session is not None:
+            http_session.close()
+            http_session = None
+
+def get_rate_limiter():
+    """获取（必要时按配置创建）请求令牌桶，未开启限流时返回 None"""
+    global rate_limiter
+    with rate_limiter_lock:
+        rate = float(config.get('rate_limit_per_second', 2))
+        if rate <= 0:
+            return None
+        if rate_limiter is None:
+            rate_limiter = TokenBucket(rate, max(1.0, float(config.get('rate_limit_burst', 5))))
+        return rate_limiter
+
+def reset_rate_limiter():
+    """丢弃当前令牌桶，下次请求时按新配置重建"""
+    global rate_limiter
+    with rate_limiter_lock:
+        rate_limiter = None
+
+def parse_retry_after(value):
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        return response.json() if response.status_code == 200 else {'code': -1}
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def start_throttle(retry_after=None):
+    """
+    触发风控后暂停所有请求
+    :param retry_after: 接口要求的等待时间（秒），None 时按 risk_backoff 退避，连续触发时加倍
+    """
+    global throttle_until, throttle_streak
+    with throttle_lock:
+        throttle_streak += 1
+        if retry_after is None:
+            seconds = float(config.get('risk_backoff', 60)) * 2 ** (throttle_streak - 1)
+            seconds = min(seconds, float(config.get('circuit_max_open_seconds', 1800)))
+        else:
+            seconds = retry_after
+        throttle_until = max(throttle_until, time.monotonic() + seconds)
+    metrics.inc('fetch_throttled_total')
+    log_info(f"⚠ B站接口触发风控，暂停所有请求 {seconds:.0f} 秒")
+
+def get_fetch_block(mid):
+    """获取该 MID 还需暂停查询的时间（秒），0 表示可以查询"""
+    now = time.monotonic()
+    with throttle_lock:
+        state = circuit_states.get(mid)
+        open_until = state['open_until'] if state is not None else 0.0
+        return max(0.0, throttle_until - now, open_until - now)
+
+def record_fetch_result(mid, data):
+    """根据查询结果更新 MID 的熔断状态：连续失败达到阈值后暂停查询，成功后恢复"""
+    global throttle_streak
+    with throttle_lock:
+        state = circuit_states.setdefault(mid, {'failures': 0, 'opens': 0, 'open_until': 0.0, 'last_data': None})
+        if data.get('code') == 0:
+            state.update(failures=0, opens=0, open_until=0.0, last_data=data)
+            throttle_streak = 0
+            return
+        if data.get('throttled') or data.get('suppressed'):
+            # 风控是全局的，不计入单个 MID 的失败次数
+            return
+        state['failures'] += 1
+        threshold = max(1, int(config.get('circuit_failure_threshold', 3)))
+        if state['failures'] < threshold:
+            return
+        seconds = float(config.get('circuit_open_seconds', 60)) * 2 ** state['opens']
+        seconds = min(seconds, float(config.get('circuit_max_open_seconds', 1800)))
+        state['open_until'] = time.monotonic() + seconds
+        state['opens'] += 1
+        # 恢复后的第一次查询再失败就立即重新暂停
+        state['failures'] = threshold - 1
+    metrics.inc('circuit_opens_total')
+    log_info(f"MID {mid} 连续查询失败，暂停查询 {seconds:.0f} 秒")
+
+def suppressed_result(mid, blocked):
+    """暂停查询期间的返回结果：有上次成功的数据时返回该数据（标记 stale），否则返回失败"""
+    with throttle_lock:
+        state = circuit_states.get(mid)
+        last_data = state['last_data'] if state is not None else None
+    if last_data is not None:
+        return dict(last_data, stale=True, retry_in=blocked)
+    return {'code': -1, 'message': f"查询已暂停，{blocked:.0f} 秒后恢复", 'suppressed': True, 'retry_in': blocked}
+
+def get_backoff_status():
+    """
+    获取限流退避状态
+    :return: {'throttle_remaining': 风控暂停剩余秒数, 'circuits': {mid: {'open_in', 'failures', 'opens'}}}（仅含暂停中的 MID）
+    """
+    now = time.monotonic()
+    with throttle_lock:
+        return {
+            'throttle_remaining': max(0.0, throttle_until - now),
+            'circuits': {
+                mid: {
+                    'open_in': state['open_until'] - now,
+                    'failures': state['failures'],
+                    'opens': state['opens']
+                }
+                for mid, state in circuit_states.items() if state['open_until'] > now
+            }
+        }
+
+def clear_backoff_state():
+    """清除风控暂停和所有熔断状态"""
+    global throttle_until, throttle_streak
+    with throttle_lock:
+        throttle_until = 0.0
+        throttle_streak = 0
+        circuit_states.clear()
+
+def request_api(url, params):
+    """向B站接口发出一次 GET 请求（受令牌桶限流，识别风控返回），返回 JSON 数据，失败时为 {'code': -1}"""
+    limiter = get_rate_limiter()
+    if limiter is not None and not limiter.acquire(timeout=float(config.get('http_timeout', 10))):
+        metrics.inc('fetch_rate_limited_total')
+        return {'code': -1, 'message': "请求排队超时", 'suppressed': True}
+
+    metrics.inc('fetch_requests_total')
+    start = time.perf_counter()
+    try:
+        with tracer.profiled(), tracer.span('http', url=url, params=params) as trace_args:
+            response = get_http_session().get(
+                url,
+                params=params,
+                timeout=config.get('http_timeout', 10)
+            )
+            trace_args['status'] = response.status_code
+        if response.status_code == 200:
+            with tracer.span('json', url=url, bytes=len(response.content)):
+                data = response.json()
+        elif response.status_code in RISK_CONTROL_HTTP_STATUS:
+            data = {'code': -412, 'message': f"HTTP {response.status_code}"}
+        else:
+            data = {'code': -1}
+        if data.get('code') in RISK_CONTROL_CODES:
+            data['throttled'] = True
+            start_throttle(parse_retry_after(response.headers.get('Retry-After')))
     except Exception as e:
         log_info(f"请求失败: {e}")
-        return {'code': -1}
+        data = {'code': -1}
+    metrics.observe('fetch_seconds', time.perf_counter() - start)
+    if data.get('code') != 0:
+        metrics.inc('fetch_errors_total')
+    return data
 
-def save_cache(fans_count, display_name='main'):
-    """保存粉丝数到缓存文件"""
-    path = os.path.join(server_inst.get_data_folder(), CACHE_FILE)
+def request_follower_count(mid):
+    """直接请求B站 card 接口获取粉丝数（不经过缓存）"""
+    return request_api(CARD_API_URL, {'mid': mid})
+
+def make_card_data(mid, name, fans):
+    """按 card 接口的格式构造查询结果，供批量查询结果与单个查询统一处理"""
+    return {'code': 0, 'data': {'card': {'mid': str(mid), 'name': name, 'fans': fans}}}
+
+def get_known_name(mid):
+    """获取 MID 最近一次查询成功时的用户名，未知时返回 None"""
+    with throttle_lock:
+        state = circuit_states.get(str(mid))
+        last_data = state['last_data'] if state is not None else None
+    return last_data['data']['card']['name'] if last_data is not None else None
+
+def parse_batch_response(data):
+    """
+    从批量接口的返回数据中取出各 MID 的粉丝数
+    兼容 data 为 {mid: {...}}、{'list': [...]} 或 [...] 的格式，粉丝数字段为 follower 或 fans
+    :return: {mid: 粉丝数}
+    """
+    payload = data.get('data')
+    if isinstance(payload, dict) and isinstance(payload.get('list'), list):
+        items = payload['list']
+    elif isinstance(payload, dict):
+        items = [dict(item, mid=item.get('mid', key)) for key, item in payload.items() if isinstance(item, dict)]
+    elif isinstance(payload, list):
+        items = payload
+    else:
+        return {}
+    counts = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        mid = item.get('mid', item.get('vmid'))
+        fans = item.get('follower', item.get('fans'))
+        if mid is not None and isinstance(fans, int):
+            counts[str(mid)] = fans
+    return counts
+
+def request_follower_counts_batch(mids):
+    """
+    通过批量接口一次查询多个 MID 的粉丝数（不经过缓存）
+    :return: {mid: 接口返回数据}，仅包含查询成功且已知用户名的 MID
+    """
+    metrics.inc('fetch_batch_requests_total')
+    with tracer.context(mids=mids):
+        data = request_api(config.get('batch_api_url', ''), {config.get('batch_api_param', 'mids'): ','.join(mids)})
+    counts = parse_batch_response(data) if data.get('code') == 0 else {}
+    results = {}
+    for mid in mids:
+        name = get_known_name(mid)
+        if mid in counts and name is not None:
+            results[mid] = make_card_data(mid, name, counts[mid])
+    return results
+
+def record_history(mid, data):
+    """将一次成功的查询结果写入历史记录"""
+    if data.get('code') != 0 or data.get('stale') or not config.get('history_enabled', True):
+        return
     try:
-        # 读取现有缓存
-        cache_data = {}
-        if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-        
-        # 更新指定显示板的缓存
-        cache_data[display_name] = int(fans_count)
-        
-        # 写回文件
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        log_info(f"缓存保存失败: {e}")
+        if history.append(mid, time.time(), data['data']['card']['fans']):
+            engine.run_in_background(history.compact, mid)
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        log_info(f"历史记录写入失败 (MID: {mid}): {e}")
 
-def load_cache(display_name='main'):
-    """从缓存文件读取粉丝数"""
+def store_follower_cache(mid, data):
+    """将查询成功的结果写入 TTL 缓存（调用方需持有 follower_cache_lock）"""
+    if data.get('code') != 0 or data.get('stale') or float(config.get('follower_cache_ttl', 10)) <= 0:
+        return
+    follower_cache[mid] = (time.monotonic(), data)
+    follower_cache.move_to_end(mid)
+    max_size = max(1, int(config.get('follower_cache_size', 256)))
+    while len(follower_cache) > max_size:
+        follower_cache.popitem(last=False)
+
+def get_follower_count(mid, use_cache=True):
+    """
+    获取B站粉丝数（带 TTL 缓存，同一 MID 的并发查询共享一次请求）
+    :param mid: B站 MID
+    :param use_cache: 是否允许使用未过期的缓存结果
+    :return: 接口返回数据，失败时为 {'code': -1}；风控暂停或熔断期间返回上次成功的数据（带 'stale': True）
+    """
+    mid = str(mid)
+    ttl = float(config.get('follower_cache_ttl', 10))
+    with follower_cache_lock:
+        if use_cache and ttl > 0:
+            entry = follower_cache.get(mid)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                follower_cache.move_to_end(mid)
+                follower_cache_stats['hits'] += 1
+                return entry[1]
+        pending = follower_inflight.get(mid)
+        is_owner = pending is None
+        if is_owner:
+            pending = {'event': threading.Event(), 'result': {'code': -1}}
+            follower_inflight[mid] = pending
+            follower_cache_stats['misses'] += 1
+        else:
+            follower_cache_stats['coalesced'] += 1
+
+    if not is_owner:
+        pending['event'].wait()
+        return pending['result']
+
+    data = {'code': -1}
+    try:
+        blocked = get_fetch_block(mid)
+        if blocked > 0:
+            metrics.inc('fetch_suppressed_total')
+            data = suppressed_result(mid, blocked)
+        else:
+            with tracer.context(mid=mid):
+                data = request_follower_count(mid)
+            record_fetch_result(mid, data)
+            record_history(mid, data)
+    finally:
+        with follower_cache_lock:
+            store_follower_cache(mid, data)
+            pending['result'] = data
+            follower_inflight.pop(mid, None)
+        pending['event'].set()
+    return data
+
+def clear_follower_cache():
+    """清空粉丝数查询缓存"""
+    with follower_cache_lock:
+        follower_cache.clear()
+
+def get_follower_cache_stats():
+    """获取粉丝数查询缓存的命中统计"""
+    with follower_cache_lock:
+        stats = dict(follower_cache_stats)
+        stats['size'] = len(follower_cache)
+    total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / total if total else 0.0
+    return stats
+
+def get_fetch_executor():
+    """获取（必要时创建）批量查询线程池"""
+    global fetch_executor
+    if fetch_executor is None:
+        workers = max(1, int(config.get('fetch_workers', 8)))
+        fetch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='BFanFetch')
+    return fetch_executor
+
+def shutdown_fetch_executor():
+    """关闭批量查询线程池"""
+    global fetch_executor
+    if fetch_executor is not None:
+        fetch_executor.shutdown(wait=False)
+        fetch_executor = None
+
+def fetch_follower_counts(mids):
+    """
+    批量获取多个MID的粉丝数（自动去重，并行请求；fetch_backend 为 batch 时优先使用批量接口）
+    :param mids: MID 列表，可包含重复项
+    :return: {mid: 接口返回数据}
+    """
+    unique_mids = list(dict.fromkeys(str(mid) for mid in mids))
+    if not unique_mids:
+        return {}
+    if config.get('fetch_backend', 'card') == 'batch':
+        return fetch_follower_counts_batched(unique_mids)
+    return fetch_follower_counts_by_card(unique_mids)
+
+def fetch_follower_counts_by_card(unique_mids):
+    """逐个 MID 并行请求 card 接口"""
+    if len(unique_mids) == 1:
+        return {unique_mids[0]: get_follower_count(unique_mids[0])}
+
+    executor = get_fetch_executor()
+    futures = {mid: executor.submit(tracer.bind(get_follower_count), mid) for mid in unique_mids}
+    results = {}
+    for mid, future in futures.items():
+        try:
+            results[mid] = future.result()
+        except Exception as e:
+            log_info(f"批量查询失败 (MID: {mid}): {e}")
+            results[mid] = {'code': -1}
+    return results
+
+def fetch_follower_counts_batched(unique_mids):
+    """
+    通过批量接口查询：缓存命中和暂停查询的 MID 不发请求，其余按 batch_size 分组，每组一次请求；
+    批量接口失败、结果中缺少的 MID 或尚不知道用户名的 MID 回退到 card 接口
+    """
+    results = {}
+    pending = []
+    ttl = float(config.get('follower_cache_ttl', 10))
+    with follower_cache_lock:
+        for mid in unique_mids:
+            entry = follower_cache.get(mid)
+            if ttl > 0 and entry is not None and time.monotonic() - entry[0] < ttl:
+                follower_cache.move_to_end(mid)
+                follower_cache_stats['hits'] += 1
+                results[mid] = entry[1]
+    for mid in unique_mids:
+        if mid in results:
+            continue
+        blocked = get_fetch_block(mid)
+        if blocked > 0:
+            metrics.inc('fetch_suppressed_total')
+            results[mid] = suppressed_result(mid, blocked)
+        elif get_known_name(mid) is None:
+            # 批量接口不返回用户名，首次查询直接使用 card 接口
+            continue
+        else:
+            pending.append(mid)
+
+    size = max(1, int(config.get('batch_size', 20)))
+    chunks = [pending[i:i + size] for i in range(0, len(pending), size)]
+    if chunks:
+        executor = get_fetch_executor()
+        for chunk, future in [(chunk, executor.submit(tracer.bind(request_follower_counts_batch), chunk)) for chunk in chunks]:
+            try:
+                fetched = future.result()
+            except Exception as e:
+                log_info(f"批量查询失败: {e}")
+                fetched = {}
+            with follower_cache_lock:
+                follower_cache_stats['misses'] += len(fetched)
+                for mid, data in fetched.items():
+                    store_follower_cache(mid, data)
+            for mid, data in fetched.items():
+                record_fetch_result(mid, data)
+                record_history(mid, data)
+            results.update(fetched)
+
+    fallback = [mid for mid in unique_mids if mid not in results]
+    if fallback:
+        if pending:
+            metrics.inc('fetch_batch_fallbacks_total', len([mid for mid in fallback if mid in pending]))
+        results.update(fetch_follower_counts_by_card(fallback))
+    return results
+
+async def fetch_follower_counts_async(mids):
+    """
+    fetch_follower_counts 的协程版本，在查询线程池中并行请求
+    :return: {mid: 接口返回数据}
+    """
+    unique_mids = list(dict.fromkeys(str(mid) for mid in mids))
+    if config.get('fetch_backend', 'card') == 'batch':
+        # 批量查询内部会向查询线程池提交任务，需在引擎的工作线程中等待
+        return await engine.run_blocking(tracer.bind(fetch_follower_counts_batched), unique_mids) or {}
+    loop = asyncio.get_running_loop()
+    executor = get_fetch_executor()
+    results = await asyncio.gather(
+        *(loop.run_in_executor(executor, tracer.bind(get_follower_count), mid) for mid in unique_mids),
+        return_exceptions=True
+    )
+    fetched = {}
+    for mid, result in zip(unique_mids, results):
+        if isinstance(result, Exception):
+            log_info(f"批量查询失败 (MID: {mid}): {result}")
+            result = {'code': -1}
+        fetched[mid] = result
+    return fetched
+
+def wait_cache_ready():
+    """插件刚加载时缓存文件在后台载入，读写缓存前等待载入完成"""
+    if not fan_cache_ready.is_set():
+        fan_cache_ready.wait(CACHE_READY_TIMEOUT)
+
+def load_cache_file():
+    """从缓存文件载入所有显示板的粉丝数到内存（仅在加载插件时调用）"""
+    start = time.perf_counter()
     path = os.path.join(server_inst.get_data_folder(), CACHE_FILE)
+    cache_data = {}
     try:
         with open(path, 'r', encoding='utf-8') as f:
             cache_data = json.load(f)
-            return cache_data.get(display_name, None)
-    except:
-        return None
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_info(f"缓存读取失败: {e}")
+    with fan_cache_lock:
+        fan_cache.clear()
+        fan_cache.update(cache_data)
+    fan_cache_ready.set()
+    metrics.observe('cache_load_seconds', time.perf_counter() - start)
 
-def get_display_config(display_name='main'):
-    """获取指定显示板的配置"""
-    for display in config['displays']:
-        if display['name'] == display_name:
-            return display
+def flush_cache():
+    """将内存中的粉丝数缓存写入文件（临时文件 + 重命名，保证原子性）"""
+    global fan_cache_dirty, fan_cache_flush_timer
+    with fan_cache_io_lock:
+        with fan_cache_lock:
+            if fan_cache_flush_timer is not None:
+                fan_cache_flush_timer.cancel()
+                fan_cache_flush_timer = None
+            if not fan_cache_dirty:
+                return
+            cache_data = dict(fan_cache)
+            fan_cache_dirty = False
+
+        start = time.perf_counter()
+        path = os.path.join(server_inst.get_data_folder(), CACHE_FILE)
+        temp_path = path + '.tmp'
+        try:
+            with tracer.span('cache_flush', displays=len(cache_data)):
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(cache_data, f, indent=2, ensure_ascii=False)
+                os.replace(temp_path, path)
+            metrics.inc('cache_flushes_total')
+            metrics.observe('cache_flush_seconds', time.perf_counter() - start)
+        except Exception as e:
+            with fan_cache_lock:
+                fan_cache_dirty = True
+            log_info(f"缓存保存失败: {e}")
+
+def save_cache(fans_count, display_name='main'):
+    """更新内存中的粉丝数缓存，并在短暂延迟后合并写入文件"""
+    fans_count = int(fans_count)
+    wait_cache_ready()
+    metrics.inc('cache_saves_total')
+    with fan_cache_lock:
+        if fan_cache.get(display_name) == fans_count:
+            return
+        fan_cache[display_name] = fans_count
+        mark_cache_dirty()
+
+def mark_cache_dirty():
+    """标记内存缓存有未写入的修改，并安排延迟写入（调用方需持有 fan_cache_lock）"""
+    global fan_cache_dirty, fan_cache_flush_timer
+    fan_cache_dirty = True
+    if fan_cache_flush_timer is None:
+        fan_cache_flush_timer = engine.call_later(config.get('cache_flush_delay', 5), engine.run_in_background, flush_cache)
+
+def drop_cache(display_names):
+    """移除指定显示板的粉丝数缓存，下次显示时完整重绘"""
+    wait_cache_ready()
+    with fan_cache_lock:
+        removed = [name for name in display_names if fan_cache.pop(name, None) is not None]
+        if removed:
+            mark_cache_dirty()
+    return removed
+
+def load_cache(display_name='main'):
+    """从内存缓存读取粉丝数"""
+    wait_cache_ready()
+    with fan_cache_lock:
+        return fan_cache.get(display_name, None)
+
+def rebuild_display_index():
+    """根据当前配置重建显示板名称索引和 MID 索引（修改 displays 或其中的 name/mid 后调用）"""
+    global display_index, mid_index, indexed_displays
+    displays = config.get('displays', [])
+    names = {}
+    mids = {}
+    for display in displays:
+        # 重名时与原先的顺序查找一致，以第一个为准
+        names.setdefault(display['name'], display)
+        mids.setdefault(str(display['mid']), []).append(display)
+    with display_index_lock:
+        display_index = names
+        mid_index = mids
+        indexed_displays = displays
+
+def ensure_display_index():
+    """displays 列表被整体替换后自动重建索引"""
+    if config.get('displays') is not indexed_displays:
+        rebuild_display_index()
+
+def get_display_config(display_name='main', strict=False):
+    """
+    获取指定显示板的配置
+    :param display_name: 显示板名称
+    :param strict: 为 True 时找不到即返回 None；否则回退到第一个显示板
+    """
+    ensure_display_index()
+    display = display_index.get(display_name)
+    if display is not None or strict:
+        return display
     # 如果找不到指定名称的显示板，返回第一个
     log_info(f"显示板 '{display_name}' 未找到，使用第一个显示板")
     return config['displays'][0] if config['displays'] else None
 
-def display_number(server, number, display_name='main', only_changed=True, callback=None):
+def get_displays_by_mid(mid):
+    """获取监控指定 MID 的所有显示板"""
+    ensure_display_index()
+    return list(mid_index.get(str(mid), ()))
+
+def get_monitored_mids():
+    """获取所有被监控的 MID（去重，按配置顺序）"""
+    ensure_display_index()
+    return list(mid_index)
+
+def get_bot_name(display_config):
+    """获取显示板使用的假人名称"""
+    return display_config.get('bot_name') or DEFAULT_BOT_NAME
+
+def parse_pos(pos):
+    """将 "x y z" 坐标字符串解析为浮点数元组，无法解析时返回 None"""
+    try:
+        return tuple(float(v) for v in pos.split())
+    except (AttributeError, ValueError):
+        return None
+
+def order_digit_hits(hits, start_pos):
+    """按最近邻顺序排列待敲击的位，尽量减少假人转动角度"""
+    origin = parse_pos(start_pos)
+    if origin is None or any(parse_pos(pos) is None for _, _, pos in hits):
+        return hits
+    remaining = list(hits)
+    ordered = []
+    current = origin
+    while remaining:
+        nearest = min(remaining, key=lambda hit: sum((a - b) ** 2 for a, b in zip(parse_pos(hit[2]), current)))
+        remaining.remove(nearest)
+        ordered.append(nearest)
+        current = parse_pos(nearest[2])
+    return ordered
+
+def plan_display_commands(display_config, number, old_number=None, bot=None, bot_alive=False, kill_after=True):
+    """
+    生成从旧数字切换到新数字所需的最少命令序列
+    :param display_config: 显示板配置
+    :param number: 要显示的数字
+    :param old_number: 当前显示的数字，None 表示完整重绘
+    :param bot: 假人名称，默认取显示板配置
+    :param bot_alive: 假人是否已在生成位置，是则省去 spawn
+    :param kill_after: 显示完成后是否清理假人
+    :return: [(命令, 描述), ...]
+    """
+    bot = bot or get_bot_name(display_config)
+    only_changed = old_number is not None
+    digits = [int(d) for d in str(number)][::-1]  # 逆序：个位在前
+    old_digits = [int(d) for d in str(old_number)][::-1] if only_changed else []
+    max_len = max(len(digits), len(old_digits))
+
+    # 需要敲击的位 [(位序号, 数字, 朝向坐标)]
+    hits = []
+    for i in range(max_len):
+        cur = digits[i] if i < len(digits) else 0
+        old = old_digits[i] if i < len(old_digits) else -1
+        if not only_changed or cur != old:
+            pos = display_config['digit_look_at'].get(str(cur), display_config['reset_pos'])
+            hits.append((i, cur, pos))
+
+    if only_changed and not hits:
+        # 没有任何位需要更新
+        return [(f"/player {bot} kill", "清理假人")] if bot_alive and kill_after else []
+
+    # 仅当显示装置不依赖敲击顺序时才可开启
+    if display_config.get('optimize_digit_order', False):
+        hits = order_digit_hits(hits, display_config['reset_pos'])
+
+    commands = []
+    if not bot_alive:
+        commands.append((f"/player {bot} spawn at {display_config['spawn_pos']}", "召唤假人"))
+    commands.append((f"/player {bot} look at {display_config['reset_pos']}", "复位朝向"))
+    commands.append((f"/player {bot} use once", "触发复位"))
+
+    facing = display_config['reset_pos']
+    for i, cur, pos in hits:
+        if pos != facing:
+            commands.append((f"/player {bot} look at {pos}", f"显示第{i+1}位: {cur}"))
+            facing = pos
+        commands.append((f"/player {bot} use once", f"敲击第{i+1}位"))
+
+    if kill_after:
+        commands.append((f"/player {bot} kill", "清理假人"))
+    return commands
+
+def format_glyph_text(char):
+    """按 sign_text_format 生成告示牌/文本展示实体中的文本组件"""
+    if config.get('sign_text_format', 'json') == 'snbt':
+        # 1.21.5 起 NBT 中的文本组件直接使用 SNBT
+        return json.dumps(char.strip())
+    return "'" + json.dumps({'text': char.strip()}, separators=(',', ':')) + "'"
+
+def get_glyph_option(display_config, key):
+    """获取 blocks 显示方式的字形设置（显示板中未设置时使用全局设置）"""
+    return display_config.get(key) or config.get(key, DEFAULT_GLYPH_OPTIONS[key])
+
+def check_digit_positions(display_config):
+    """
+    检查 blocks 显示方式的 digit_positions 和字形设置
+    :return: 错误信息，没有问题时返回 None
+    """
+    positions = display_config.get('digit_positions')
+    if not isinstance(positions, list) or not positions:
+        return "digit_positions 未设置或为空"
+    for i, pos in enumerate(positions):
+        parsed = parse_pos(pos)
+        if parsed is None or len(parsed) != 3:
+            return f"digit_positions 第{i+1}项不是有效坐标: {pos!r}"
+    if get_glyph_option(display_config, 'glyph_mode') not in ('sign', 'text_display', 'block'):
+        return f"glyph_mode 无效: {get_glyph_option(display_config, 'glyph_mode')!r}"
+    if get_glyph_option(display_config, 'glyph_direction') not in GLYPH_DIRECTIONS:
+        return f"glyph_direction 无效: {get_glyph_option(display_config, 'glyph_direction')!r}"
+    return None
+
+def plan_glyph_commands(display_config, index, char, pos):
+    """生成在一个位置上显示一个字符（数字或空白）的命令"""
+    mode = get_glyph_option(display_config, 'glyph_mode')
+    x, y, z = parse_pos(pos)
+    if mode == 'text_display':
+        selector = f"@e[type=minecraft:text_display,x={x:g},y={y:g},z={z:g},distance=..0.5,limit=1]"
+        return [(f"/data merge entity {selector} {{text:{format_glyph_text(char)}}}", f"显示第{index+1}位: {char}")]
+    if mode == 'block':
+        dx, dz = GLYPH_DIRECTIONS[get_glyph_option(display_config, 'glyph_direction')]
+        on_block = get_glyph_option(display_config, 'glyph_block')
+        off_block = get_glyph_option(display_config, 'glyph_background')
+        x, y, z = int(round(x)), int(round(y)), int(round(z))
+        commands = []
+        for row, pixels in enumerate(DIGIT_GLYPHS[char]):
+            # 同一行中连续相同的像素合并为一条 fill
+            col = 0
+            while col < len(pixels):
+                end = col
+                while end + 1 < len(pixels) and pixels[end + 1] == pixels[col]:
+                    end += 1
+                block = on_block if pixels[col] == '1' else off_block
+                start_pos = f"{x + dx * col} {y - row} {z + dz * col}"
+                if end == col:
+                    commands.append((f"/setblock {start_pos} {block}", f"绘制第{index+1}位: {char}"))
+                else:
+                    end_pos = f"{x + dx * end} {y - row} {z + dz * end}"
+                    commands.append((f"/fill {start_pos} {end_pos} {block}", f"绘制第{index+1}位: {char}"))
+                col = end + 1
+        return commands
+    # 告示牌
+    text = format_glyph_text(char)
+    if config.get('sign_text_format', 'json') == 'legacy':
+        nbt = f"{{Text1:{text}}}"
+    else:
+        nbt = f"{{front_text:{{messages:[{text},{format_glyph_text(' ')},{format_glyph_text(' ')},{format_glyph_text(' ')}]}}}}"
+    return [(f"/data merge block {int(round(x))} {int(round(y))} {int(round(z))} {nbt}", f"显示第{index+1}位: {char}")]
+
+def plan_block_commands(display_config, number, old_number=None):
+    """
+    blocks 显示方式：直接修改每一位对应位置上的告示牌、文本展示实体或方块，跳过未变化的位
+    显示板配置:
+      digit_positions: 从最高位到个位每一位的坐标，数字靠右对齐，多出的位显示为空白，位数不足时显示全 9
+      glyph_mode: sign 告示牌第一行 / text_display 文本展示实体 / block 用方块绘制 3×5 点阵（坐标为字形左上角）
+      glyph_direction, glyph_block, glyph_background: block 模式下字形的延伸方向、字形方块和背景方块
+      以上字形设置在显示板中未设置时使用全局设置
+    :param old_number: 当前显示的数字，None 表示完整重绘
+    :return: [(命令, 描述), ...]，配置有误时抛出 ValueError
+    """
+    error = check_digit_positions(display_config)
+    if error:
+        raise ValueError(f"配置有误: {error}")
+    positions = display_config['digit_positions']
+    width = len(positions)
+    if number >= 10 ** width:
+        log_info(f"显示板 '{display_config['name']}' 只有 {width} 位，无法显示 {number}")
+        number = 10 ** width - 1
+    chars = str(number).rjust(width) if width else ''
+    old_chars = str(min(old_number, 10 ** width - 1)).rjust(width) if old_number is not None and width else None
+
+    commands = []
+    for i, (pos, char) in enumerate(zip(positions, chars)):
+        if old_chars is not None and old_chars[i] == char:
+            continue
+        commands.extend(plan_glyph_commands(display_config, i, char, pos))
+    return commands
+
+def plan_render_commands(display_config, number, old_number=None):
+    """按显示板的显示方式生成命令序列（预览用，假人方式按完整流程生成）"""
+    if get_render_backend(display_config) == 'blocks':
+        return plan_block_commands(display_config, number, old_number)
+    return plan_display_commands(display_config, number, old_number)
+
+def get_render_lane(display_config):
+    """显示任务排队的通道：使用假人的显示板按假人排队，blocks 显示方式每个显示板单独一个通道"""
+    if get_render_backend(display_config) == 'blocks':
+        return f"#blocks:{display_config['name']}"
+    return get_bot_name(display_config)
+
+def get_render_backend(display_config):
+    """获取显示板使用的显示方式（显示板中未设置时使用全局设置）"""
+    return display_config.get('render_backend') or config.get('render_backend', 'commands')
+
+def get_datapack_function_dir():
+    """获取数据包中存放函数的目录，未配置 datapack_path 时返回 None"""
+    path = config.get('datapack_path', '')
+    if not path:
+        return None
+    # 1.21（pack_format 45）起函数目录由 functions 改为 function
+    folder = 'function' if int(config.get('datapack_pack_format', DATAPACK_MACRO_PACK_FORMAT)) >= 45 else 'functions'
+    return os.path.join(path, 'data', config.get('datapack_namespace', 'bfan'), folder)
+
+def get_datapack_function_name(display_name):
+    """显示板对应的函数目录名（函数名只允许小写字母、数字和 _-.，附加哈希避免不同名称冲突）"""
+    slug = re.sub(r'[^a-z0-9_.-]', '_', display_name.lower()).strip('_') or 'board'
+    return f"{slug}_{hashlib.md5(display_name.encode('utf-8')).hexdigest()[:6]}"
+
+def get_datapack_ticks(display_config):
+    """datapack 显示方式中相邻两步的间隔（游戏刻）"""
+    return max(1, round(display_config['delay_between_commands'] * TICKS_PER_SECOND))
+
+def plan_datapack_files(display_config, function_dir):
+    """
+    生成显示板固定的数据包函数（内容只随配置变化）：
+    start 接收宏参数 steps 存入 storage 并执行 step；step 以假人执行第一步，还有剩余时按间隔 schedule 自身
+    :return: {文件路径: 内容}
+    """
+    namespace = config.get('datapack_namespace', 'bfan')
+    name = get_datapack_function_name(display_config['name'])
+    prefix = f"{namespace}:{name}"
+    board_dir = os.path.join(function_dir, name)
+    ticks = get_datapack_ticks(display_config)
+    return {
+        os.path.join(board_dir, 'start.mcfunction'): (
+            f"# {display_config['name']}: function {prefix}/start {{steps:[{{a:\"look at ...\"}}, ...]}}\n"
+            f"$data modify storage {prefix} steps set value $(steps)\n"
+            f"function {prefix}/step\n"
+        ),
+        os.path.join(board_dir, 'step.mcfunction'): (
+            f"# 执行队列中的第一步，剩余步骤每 {ticks} 刻执行一步\n"
+            f"function {prefix}/exec with storage {prefix} steps[0]\n"
+            f"data remove storage {prefix} steps[0]\n"
+            f"execute if data storage {prefix} steps[0] run schedule function {prefix}/step {ticks}t\n"
+        ),
+        os.path.join(board_dir, 'exec.mcfunction'): f"$player {get_bot_name(display_config)} $(a)\n"
+    }
+
+def write_datapack_functions(display_config):
+    """
+    写入显示板固定的数据包函数，与文件中已有内容相同时不重写
+    :return: 是否有文件变更（需要 /reload 才会生效）；未配置数据包目录、版本不支持或写入失败时返回 None
+    """
+    function_dir = get_datapack_function_dir()
+    if function_dir is None:
+        log_info("render_backend 为 datapack 但未设置 datapack_path，改为逐条发送命令")
+        return None
+    pack_format = int(config.get('datapack_pack_format', DATAPACK_MACRO_PACK_FORMAT))
+    if pack_format < DATAPACK_MACRO_PACK_FORMAT:
+        log_info(f"datapack 显示方式需要函数宏（pack_format {DATAPACK_MACRO_PACK_FORMAT} 及以上），改为逐条发送命令")
+        return None
+    changed = False
+    try:
+        mcmeta_path = os.path.join(config['datapack_path'], 'pack.mcmeta')
+        if not os.path.isfile(mcmeta_path):
+            os.makedirs(config['datapack_path'], exist_ok=True)
+            with open(mcmeta_path, 'w', encoding='utf-8') as f:
+                json.dump({'pack': {'pack_format': pack_format, 'description': 'Bilibili Follower Display'}}, f, indent=2)
+            changed = True
+        for path, content in plan_datapack_files(display_config, function_dir).items():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    if f.read() == content:
+                        continue
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            changed = True
+        return changed
+    except OSError as e:
+        log_info(f"数据包写入失败，改为逐条发送命令: {e}")
+        return None
+
+def get_datapack_signature(display_config):
+    """显示板数据包函数内容的签名，配置变更导致函数内容变化时签名随之变化"""
+    function_dir = get_datapack_function_dir() or ''
+    files = sorted(plan_datapack_files(display_config, function_dir).items())
+    return hashlib.md5(repr((config.get('datapack_pack_format'), files)).encode('utf-8')).hexdigest()
+
+def is_datapack_disabled(display_config):
+    """显示板的数据包函数是否因连续触发失败而停用（函数内容变化后重新启用）"""
+    with datapack_lock:
+        entry = datapack_failures.get(get_datapack_function_name(display_config['name']))
+    return (entry is not None and entry[0] >= DATAPACK_MAX_TRIGGER_FAILURES
+            and entry[1] == get_datapack_signature(display_config))
+
+def record_datapack_trigger(display_config, success):
+    """
+    记录数据包函数触发结果：成功时清除失败记录，失败时累计次数
+    :return: 失败后是否已达到停用次数
+    """
+    name = get_datapack_function_name(display_config['name'])
+    signature = get_datapack_signature(display_config)
+    with datapack_lock:
+        if success:
+            datapack_failures.pop(name, None)
+            return False
+        count, last = datapack_failures.get(name, (0, signature))
+        count = count + 1 if last == signature else 1
+        datapack_failures[name] = (count, signature)
+    return count >= DATAPACK_MAX_TRIGGER_FAILURES
+
+def is_datapack_trigger_error(result):
+    """RCON 返回的 /function 结果是否表示触发失败"""
+    return result is not None and any(error in result for error in DATAPACK_TRIGGER_ERRORS)
+
+def display_number(server, number, display_name='main', only_changed=True, callback=None, group='manual', cycle=None):
     """
     显示数字到假人屏幕
+    同一假人的显示任务排队依次执行，不同假人的显示任务可同时进行；
+    同一显示板尚未开始的旧任务会被新数字直接替换
     :param server: server 实例
     :param number: 要显示的数字
     :param display_name: 显示板名称
     :param only_changed: 是否仅更新变化的位数
-    :param callback: 显示完成后的回调函数
+    :param callback: 显示结束（完成、被替换或被取消）后的回调函数
+    :param group: 任务分组，用于 cancel_renders 按分组取消
+    :param cycle: 发起显示的定时更新轮次，用于性能追踪
+    :return: Future，显示完成时结果为 True，被替换、取消或失败时为 False
     """
-    display_config = get_display_config(display_name)
+    future = Future()
+    display_config = get_display_config(display_name, strict=True)
     if not display_config:
         server.say(f"❌ 显示板 '{display_name}' 配置不存在")
         if callback:
             callback()
-        return
-    
-    digits = [int(d) for d in str(number)][::-1]  # 逆序：个位在前
-    old_digits = [int(d) for d in str(load_cache(display_name))][::-1] if only_changed and load_cache(display_name) else []
-    
-    max_len = max(len(digits), len(old_digits)) if only_changed else len(digits)
-    
-    # 构建命令序列
-    commands = [
-        (f"/player Fan spawn at {display_config['spawn_pos']}", "召唤假人"),
-        (f"/player Fan look at {display_config['reset_pos']}", "复位朝向"),
-        ("/player Fan use once", "触发复位")
-    ]
-    
-    for i in range(max_len):
-        cur = digits[i] if i < len(digits) else 0
-        old = old_digits[i] if i < len(old_digits) else -1
-        pos = display_config['digit_look_at'].get(str(cur), display_config['reset_pos'])
-        
-        if not only_changed or cur != old:
-            commands.append((f"/player Fan look at {pos}", f"显示第{i+1}位: {cur}"))
-            commands.append(("/player Fan use once", f"敲击第{i+1}位"))
+        future.set_result(False)
+        return future
+
+    job = {
+        'id': next(render_ids),
+        'server': server,
+        'number': number,
+        'display': display_name,
+        'bot': get_render_lane(display_config),
+        'fake_player': get_render_backend(display_config) != 'blocks',
+        'only_changed': only_changed,
+        'callback': callback,
+        'group': group,
+        'handle': None,
+        'started': False,
+        'cancelled': False,
+        'future': future,
+        'queued_at': time.perf_counter(),
+        'cycle': cycle
+    }
+    superseded = None
+    with render_lock:
+        lane = render_lanes.setdefault(job['bot'], deque())
+        for index, pending in enumerate(lane):
+            if pending['display'] == display_name:
+                # 合并：新数字直接占用旧任务在队列中的位置
+                job['only_changed'] = only_changed and pending['only_changed']
+                lane[index] = job
+                pending['cancelled'] = True
+                active_renders.pop(pending['id'], None)
+                superseded = pending
+                break
         else:
-            commands.append((f"/player Fan look at {pos}", f"跳过第{i+1}位（未变）"))
-    
-    commands.append(("/player Fan kill", "清理假人"))
-    
-    def run_cmd(index):
-        if index >= len(commands):
-            # 所有命令执行完成
-            save_cache(number, display_name)
-            if callback:
-                callback()
-            return
-        cmd, desc = commands[index]
+            lane.append(job)
+        active_renders[job['id']] = job
+    metrics.inc('renders_queued_total')
+    if superseded is not None:
+        metrics.inc('renders_superseded_total')
+        log_debug(f"显示板 '{display_name}' 的待显示数字 {superseded['number']} 已被 {number} 替换")
+        finish_job(superseded, False)
+    dispatch_renders()
+    return future
+
+def finish_job(job, success):
+    """通知显示任务的调用方：执行回调并设置 Future 结果"""
+    if job['callback']:
+        job['callback']()
+    if not job['future'].done():
+        job['future'].set_result(success)
+
+def dispatch_renders():
+    """为空闲的假人启动队列中的下一个显示任务（受 max_concurrent_renders 限制）"""
+    limit = max(1, int(config.get('max_concurrent_renders', 4)))
+    to_start = []
+    with render_lock:
+        for bot, lane in list(render_lanes.items()):
+            if not lane:
+                del render_lanes[bot]
+                continue
+            if bot in busy_bots or len(busy_bots) >= limit:
+                continue
+            job = lane.popleft()
+            if not lane:
+                del render_lanes[bot]
+            job['started'] = True
+            busy_bots.add(bot)
+            to_start.append(job)
+    for job in to_start:
+        job['handle'] = engine.submit(run_render(job))
+        if job['handle'] is None:
+            # 引擎未运行，协程不会执行
+            with render_lock:
+                release_render(job)
+            finish_job(job, False)
+
+def release_render(job):
+    """释放显示任务占用的假人（调用方需持有 render_lock）"""
+    active_renders.pop(job['id'], None)
+    busy_bots.discard(job['bot'])
+
+def use_rcon_pacing(server):
+    """是否启用基于 RCON 反馈的自适应命令间隔"""
+    return config.get('adaptive_delay', False) and server.is_rcon_running()
+
+def execute_timed(server, cmd):
+    """
+    通过 RCON 执行命令并测量完成耗时
+    RCON 命令在服务端主线程的下一个 tick 处理，往返耗时能直接反映服务端卡顿程度
+    :return: 耗时（秒），RCON 失败时改用普通方式执行并返回 None
+    """
+    start = time.monotonic()
+    result = server.rcon_query(cmd.lstrip('/'))
+    if result is None:
         server.execute(cmd)
+        return None
+    return time.monotonic() - start
+
+def next_command_delay(display_name, display_config, latency):
+    """
+    计算下一条命令前的等待时间
+    自适应模式下，服务端流畅时逐步缩短到下限，出现卡顿时按倍数退避
+    :param latency: 上一条命令的完成耗时，None 表示无反馈（使用固定间隔）
+    """
+    base_delay = display_config['delay_between_commands']
+    if latency is None or not config.get('adaptive_delay', False):
+        return base_delay
+
+    floor = float(config.get('adaptive_delay_min', 0.2))
+    ceiling = max(floor, float(config.get('adaptive_delay_max', 3.0)))
+    delay = command_delays.get(display_name, base_delay)
+    if latency <= float(config.get('adaptive_lag_threshold', 0.15)):
+        delay = max(floor, delay * 0.8)
+    else:
+        delay = min(ceiling, max(delay * 1.5, latency * 2))
+    command_delays[display_name] = delay
+    return delay
+
+def has_next_render_at(bot, spawn_pos):
+    """判断该假人队列中的下一个任务是否在同一位置生成"""
+    with render_lock:
+        lane = render_lanes.get(bot)
+        next_job = lane[0] if lane else None
+    if next_job is None:
+        return False
+    next_config = get_display_config(next_job['display'], strict=True)
+    return next_config is not None and next_config.get('spawn_pos') == spawn_pos
+
+def track_bot_state(bot, cmd, spawn_pos):
+    """根据已执行的命令记录假人是否存活"""
+    with render_lock:
+        if cmd.endswith(' kill'):
+            alive_bots.pop(bot, None)
+        elif ' spawn at ' in cmd:
+            alive_bots[bot] = spawn_pos
+
+async def run_commands(job, display_config, commands):
+    """逐条执行命令，命令间按 delay_between_commands（或自适应间隔）等待，任务被取消时停止，返回执行的命令数"""
+    server = job['server']
+    executed = 0
+    for cmd, desc in commands:
+        if job['cancelled']:
+            # 任务可能在协程开始前被取消（此时尚无 handle 可取消），不再生成已被清理的假人
+            break
+        log_debug(f"{desc}: {cmd}")
+        latency = None
+        with tracer.span('command', display=job['display'], cycle=job['cycle'], command=cmd):
+            if use_rcon_pacing(server):
+                # 通过 RCON 执行以测量命令实际完成时间
+                latency = await engine.run_blocking(execute_timed, server, cmd)
+            else:
+                server.execute(cmd)
+        track_bot_state(job['bot'], cmd, display_config['spawn_pos'])
+        delay = next_command_delay(job['display'], display_config, latency)
+        executed += 1
+        with tracer.span('pacing', display=job['display'], cycle=job['cycle'], delay=delay):
+            await asyncio.sleep(delay)
+    return executed
+
+async def run_datapack_commands(job, display_config, commands):
+    """
+    通过显示板固定的数据包函数执行命令序列：一条 /function 以宏参数传入本次的步骤，各步骤由游戏内 schedule 按间隔执行
+    函数文件只在首次使用或配置变更后写入并 /reload；开启 RCON 时确认触发成功并等待游戏内的步骤实际执行完
+    函数未变更时连续触发失败的显示板在配置变更前不再使用数据包
+    :return: 执行的命令数；数据包不可用或触发失败时返回 None，由调用方回退到逐条执行
+    """
+    if not commands:
+        return 0
+    bot_prefix = f"/player {job['bot']} "
+    if get_bot_name(display_config) != job['bot'] or not all(cmd.startswith(bot_prefix) for cmd, _ in commands):
+        return None
+    if is_datapack_disabled(display_config):
+        return None
+    changed = await engine.run_blocking(write_datapack_functions, display_config)
+    if changed is None:
+        return None
+
+    server = job['server']
+    reload_delay = max(0.0, float(config.get('datapack_reload_delay', 1.0)))
+    reload_deadline = None
+    if changed:
+        log_info("数据包函数已更新，重新载入数据包")
+        reloaded = server.is_rcon_running() and await engine.run_blocking(server.rcon_query, 'reload') is not None
+        if reloaded:
+            # 重载在服务端异步完成，触发失败时在 datapack_reload_delay 内重试
+            reload_deadline = time.monotonic() + reload_delay
+        else:
+            server.execute('/reload')
+            await asyncio.sleep(reload_delay)
+    if job['cancelled']:
+        return 0
+
+    prefix = f"{config.get('datapack_namespace', 'bfan')}:{get_datapack_function_name(display_config['name'])}"
+    steps = ','.join('{a:' + json.dumps(cmd[len(bot_prefix):], ensure_ascii=False) + '}' for cmd, _ in commands)
+    trigger = f"function {prefix}/start {{steps:[{steps}]}}"
+    ticks = get_datapack_ticks(display_config)
+    job['scheduled_functions'] = [f"{prefix}/step"]
+    log_debug(f"数据包显示 '{job['display']}': {len(commands)} 步，每步间隔 {ticks} 刻")
+
+    verified = False
+    if server.is_rcon_running():
+        result = await engine.run_blocking(server.rcon_query, trigger)
+        while (is_datapack_trigger_error(result) and reload_deadline is not None
+               and time.monotonic() < reload_deadline and not job['cancelled']):
+            await asyncio.sleep(DATAPACK_RELOAD_RETRY_INTERVAL)
+            result = await engine.run_blocking(server.rcon_query, trigger)
+        if job['cancelled']:
+            return 0
+        if is_datapack_trigger_error(result):
+            metrics.inc('datapack_trigger_failures_total')
+            if record_datapack_trigger(display_config, False):
+                log_info(f"显示板 '{job['display']}' 的数据包函数连续 {DATAPACK_MAX_TRIGGER_FAILURES} 次触发失败，"
+                         f"配置变更前改为逐条发送命令: {result}")
+            else:
+                log_info(f"数据包函数触发失败，改为逐条发送命令: {result}")
+            return None
+        verified = result is not None
+        if verified:
+            record_datapack_trigger(display_config, True)
+    if not verified:
+        server.execute(f"/{trigger}")
+    metrics.inc('datapack_renders_total')
+
+    spawn_pos = display_config['spawn_pos']
+    spawn_cmd = next((cmd for cmd, _ in commands if ' spawn at ' in cmd), None)
+    if spawn_cmd is not None:
+        track_bot_state(job['bot'], spawn_cmd, spawn_pos)
+    # 等待游戏内的最后一步执行完毕
+    expected = len(commands) * ticks / TICKS_PER_SECOND
+    await asyncio.sleep(expected)
+    if verified:
+        # 服务端低于 20 TPS 时 schedule 会推迟，通过 RCON 确认队列已清空
+        deadline = time.monotonic() + expected * DATAPACK_MAX_WAIT_FACTOR
+        while not job['cancelled'] and time.monotonic() < deadline:
+            result = await engine.run_blocking(server.rcon_query, f"execute if data storage {prefix} steps[0]")
+            if result is None or not result.startswith('Test passed'):
+                break
+            await asyncio.sleep(ticks / TICKS_PER_SECOND)
+    track_bot_state(job['bot'], commands[-1][0], spawn_pos)
+    return len(commands)
+
+def run_block_render(job, display_config, cached):
+    """blocks 显示方式：直接执行所有方块/告示牌命令（无需假人，命令之间不等待），返回执行的命令数"""
+    commands = plan_block_commands(display_config, job['number'], cached)
+    job['steps'] = len(commands)
+    for cmd, desc in commands:
         log_debug(f"{desc}: {cmd}")
-        timer = threading.Timer(display_config['delay_between_commands'], run_cmd, [index + 1])
-        timer.start()
+        job['server'].execute(cmd)
+    return len(commands)
+
+async def run_bot_render(job, display_config, cached):
+    """假人显示方式：规划并执行假人命令（逐条或通过数据包），返回执行的命令数"""
+    display_name = job['display']
+    bot = job['bot']
+    spawn_pos = display_config['spawn_pos']
+    with render_lock:
+        alive_at = alive_bots.get(bot)
+    bot_alive = alive_at == spawn_pos
+    kill_after = not config.get('keep_bot_alive', False)
+
+    commands = plan_display_commands(display_config, job['number'], cached, bot, bot_alive, kill_after)
+    if alive_at is not None and not bot_alive and commands:
+        # 假人仍保留在其他位置（共用假人的显示板或 spawn_pos 已修改），先清理再生成，否则 spawn 会被拒绝
+        commands.insert(0, (f"/player {bot} kill", "清理其他位置的假人"))
+    if cached is not None or bot_alive:
+        full_steps = len(plan_display_commands(display_config, job['number'], None, bot))
+        log_debug(f"显示计划 '{display_name}': {len(commands)} 步（完整重绘 {full_steps} 步），"
+                  f"节省约 {(full_steps - len(commands)) * display_config['delay_between_commands']:.1f} 秒")
+    job['steps'] = len(commands)
+    if commands and commands[-1][0].endswith(' kill') and has_next_render_at(bot, spawn_pos):
+        # 同一假人的下一个任务在同一位置生成，保留假人以省去 kill/spawn
+        commands = commands[:-1]
+
+    executed = None
+    if get_render_backend(display_config) == 'datapack':
+        executed = await run_datapack_commands(job, display_config, commands)
+    if executed is None:
+        executed = await run_commands(job, display_config, commands)
+    return executed
+
+async def run_render(job):
+    """执行一个显示任务（协程），无论成功、失败还是出错都释放假人并通知调用方；被取消的任务由 cancel_renders 处理"""
+    success = False
+    try:
+        success = await render_job(job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        metrics.inc('renders_failed_total')
+        if server_inst:
+            server_inst.logger.warning(f"[Bilibili] 显示板 '{job['display']}' 显示出错: {e!r}")
+        job['server'].say(f"❌ 显示板 '{job['display']}' 显示失败: {e}")
+    finally:
+        with render_lock:
+            finished = not job['cancelled']
+            if finished:
+                release_render(job)
+        if finished:
+            finish_job(job, success)
+            dispatch_renders()
+            # 为后续任务保留的假人在后续任务被取消、或本任务出错中止时不再有人清理
+            release_idle_bots()
+
+async def render_job(job):
+    """
+    执行显示任务的命令序列（命令间隔通过 asyncio.sleep 控制）
+    :return: 是否显示完成（显示板不存在或任务已取消时为 False）
+    """
+    number = job['number']
+    display_name = job['display']
+
+    display_config = get_display_config(display_name, strict=True)
+    if not display_config:
+        return False
+
+    cached = load_cache(display_name) if job['only_changed'] else None
+    start = time.perf_counter()
+    metrics.observe('render_queue_seconds', start - job['queued_at'])
+    trace_args = {'display': display_name, 'cycle': job['cycle'], 'number': number}
+    tracer.record('render_queue', job['queued_at'], start, trace_args, track='显示排队')
+    with tracer.profiled(), tracer.span('render', **trace_args) as render_args:
+        if get_render_backend(display_config) == 'blocks':
+            executed = run_block_render(job, display_config, cached)
+        else:
+            executed = await run_bot_render(job, display_config, cached)
+        render_args['commands'] = executed
+
+    if job['cancelled']:
+        return False
+    # 所有命令执行完成
+    metrics.inc('renders_total')
+    metrics.inc('render_commands_total', executed)
+    metrics.observe('render_seconds', time.perf_counter() - start)
+    metrics.observe('render_commands', executed, COUNT_BUCKETS)
+    with tracer.span('save_cache', display=display_name, cycle=job['cycle']):
+        save_cache(number, display_name)
+    return True
+
+def cancel_renders(group=None, displays=None):
+    """
+    取消排队中及正在进行的显示任务，并清理对应的假人
+    :param group: 仅取消指定分组的任务，None 表示全部
+    :param displays: 仅取消这些显示板的任务，None 表示全部
+    :return: 被取消的显示板名称列表
+    """
+    cancelled_jobs = []
+    interrupted_bots = set()
+    interrupted_functions = []
+    with render_lock:
+        for job in list(active_renders.values()):
+            if group is not None and job['group'] != group:
+                continue
+            if displays is not None and job['display'] not in displays:
+                continue
+            job['cancelled'] = True
+            if job['handle'] is not None:
+                job['handle'].cancel()
+            if job['started']:
+                if job['fake_player']:
+                    interrupted_bots.add(job['bot'])
+                    interrupted_functions.extend(job.get('scheduled_functions', ()))
+                release_render(job)
+            else:
+                # 排队中的任务没有占用假人，不能释放同一假人上正在进行的任务
+                lane = render_lanes.get(job['bot'])
+                if lane is not None and job in lane:
+                    lane.remove(job)
+                active_renders.pop(job['id'], None)
+            cancelled_jobs.append(job)
+    with render_lock:
+        if group is None and displays is None:
+            # 同时清理为后续任务保留的假人
+            interrupted_bots.update(alive_bots)
+        for bot in interrupted_bots:
+            alive_bots.pop(bot, None)
+    if server_inst:
+        # 数据包显示中尚未执行的步骤
+        for function_id in interrupted_functions:
+            server_inst.execute(f"/schedule clear {function_id}")
+        for bot in interrupted_bots:
+            server_inst.execute(f"/player {bot} kill")
+    metrics.inc('renders_cancelled_total', len(cancelled_jobs))
+    for job in cancelled_jobs:
+        finish_job(job, False)
+    names = [job['display'] for job in cancelled_jobs]
+    if names:
+        log_info(f"已中止显示任务: {', '.join(names)}")
+    dispatch_renders()
+    # 被取消的排队任务原本会沿用上一个任务保留的假人
+    release_idle_bots()
+    return names
+
+def release_idle_bots():
+    """清理空闲的保留假人：未开启 keep_bot_alive，或已没有显示板使用该假人"""
+    used_bots = {get_bot_name(display) for display in config['displays']}
+    keep_alive = config.get('keep_bot_alive', False)
+    with render_lock:
+        idle = [
+            bot for bot in alive_bots
+            if bot not in busy_bots and bot not in render_lanes and not (keep_alive and bot in used_bots)
+        ]
+        for bot in idle:
+            alive_bots.pop(bot, None)
+    if server_inst:
+        for bot in idle:
+            server_inst.execute(f"/player {bot} kill")
+    return idle
+
+# ===== API 功能 =====
+
+def api_submit_display_number(display_name, number, only_changed=False):
+    """
+    API: 将数字加入指定显示板的显示队列
+    同一显示板尚未开始显示的旧数字会被替换，适合高频推送数值的调用方
+    :param display_name: 显示板名称
+    :param number: 要显示的数字
+    :param only_changed: 是否仅更新变化的位数
+    :return: (Future, 提示信息)，参数错误时 Future 为 None；Future 在显示完成时结果为 True，被替换或取消时为 False
+    """
+    display_config = get_display_config(display_name, strict=True)
+    if not display_config:
+        return None, f"显示板 '{display_name}' 不存在"
     
-    run_cmd(0)
+    if not display_config.get('open_api', False):
+        return None, f"显示板 '{display_name}' 未开放API"
+    
+    try:
+        number = int(number)
+    except (TypeError, ValueError):
+        return None, "数字格式错误"
+    future = display_number(server_inst, number, display_name, only_changed=only_changed, group='api')
+    return future, f"已在显示板 '{display_name}' 上显示数字 {number}"
+
+def api_display_number(display_name, number, only_changed=False):
+    """
+    API: 在其他显示板上显示指定数字
+    :param display_name: 显示板名称
+    :param number: 要显示的数字
+    :param only_changed: 是否仅更新变化的位数
+    :return: 成功返回True，失败返回False和错误信息
+    """
+    try:
+        future, message = api_submit_display_number(display_name, number, only_changed)
+        return future is not None, message
+    except Exception as e:
+        return False, f"显示失败: {str(e)}"
+
+def api_plan_display_number(display_name, number, old_number=None):
+    """
+    API: 预览显示数字所需的命令序列（不执行）
+    :param display_name: 显示板名称
+    :param number: 要显示的数字
+    :param old_number: 当前显示的数字，None 表示完整重绘
+    :return: [(命令, 描述), ...]，显示板不存在时返回 None；blocks 显示板配置有误时抛出 ValueError
+    """
+    display_config = get_display_config(display_name, strict=True)
+    if not display_config:
+        return None
+    return plan_render_commands(display_config, int(number), old_number)
+
+def get_history(display_name, since=None, step=None):
+    """
+    API: 获取显示板所监控 MID 的粉丝数历史
+    :param display_name: 显示板名称
+    :param since: 起始时间戳（秒），None 表示最近 24 小时
+    :param step: 降采样间隔（秒），每个间隔取最后一条记录；None 时按范围自动选择，使返回的记录不超过 HISTORY_MAX_POINTS 条；
+                 0 表示原始记录（范围较长时会占用较多内存）
+    :return: [(时间戳, 粉丝数), ...]，显示板不存在时返回 None
+    """
+    display_config = get_display_config(display_name, strict=True)
+    if not display_config:
+        return None
+    if since is None:
+        since = time.time() - HISTORY_DEFAULT_HOURS * 3600
+    if step is None:
+        step = -(-max(0, time.time() - since) // HISTORY_MAX_POINTS)
+    return history.query(display_config['mid'], since, step=int(step))
+
+def get_metrics():
+    """API: 获取插件运行指标（含粉丝数查询缓存统计）"""
+    snapshot = metrics.snapshot()
+    snapshot['follower_cache'] = get_follower_cache_stats()
+    return snapshot
+
+def format_stats():
+    """生成 !!fan stats 的输出内容"""
+    snapshot = get_metrics()
+    counters = snapshot['counters']
+    histograms = snapshot['histograms']
+    cache_stats = snapshot['follower_cache']
+
+    def latency(name):
+        data = histograms.get(name)
+        if not data or not data['count']:
+            return "无数据"
+        return f"平均 {data['avg'] * 1000:.0f}ms / 最大 {data['max'] * 1000:.0f}ms ({data['count']} 次)"
+
+    render_commands = histograms.get('render_commands')
+    avg_commands = f"{render_commands['avg']:.1f}" if render_commands and render_commands['count'] else "-"
+    return "\n".join([
+        "📈 插件运行统计:",
+        f"查询: {counters.get('fetch_requests_total', 0)} 次（批量 {counters.get('fetch_batch_requests_total', 0)} 次，"
+        f"回退单个查询 {counters.get('fetch_batch_fallbacks_total', 0)} 个MID），"
+        f"失败 {counters.get('fetch_errors_total', 0)} 次，耗时 {latency('fetch_seconds')}",
+        f"限流: 触发风控 {counters.get('fetch_throttled_total', 0)} 次，MID 暂停 {counters.get('circuit_opens_total', 0)} 次，"
+        f"暂停期间跳过 {counters.get('fetch_suppressed_total', 0)} 次，排队超时 {counters.get('fetch_rate_limited_total', 0)} 次",
+        f"查询缓存: 命中 {cache_stats['hits']}，未命中 {cache_stats['misses']}，合并 {cache_stats['coalesced']}，命中率 {cache_stats['hit_rate']:.0%}",
+        f"显示: 完成 {counters.get('renders_total', 0)}，被替换 {counters.get('renders_superseded_total', 0)}，"
+        f"取消 {counters.get('renders_cancelled_total', 0)}，出错 {counters.get('renders_failed_total', 0)}，平均每次 {avg_commands} 条命令",
+        f"显示耗时: {latency('render_seconds')}，排队 {latency('render_queue_seconds')}",
+        f"缓存写入: {counters.get('cache_flushes_total', 0)} 次，耗时 {latency('cache_flush_seconds')}",
+        f"轮询延迟: {latency('poll_tick_lag_seconds')}，因请求上限推迟 {counters.get('poll_deferred_total', 0)} 次，出错 {counters.get('poll_errors_total', 0)} 次"
+    ])
+
+def export_metrics():
+    """将指标以 Prometheus 文本格式写入数据目录"""
+    path = os.path.join(server_inst.get_data_folder(), METRICS_FILE)
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(metrics.to_prometheus())
+        os.replace(temp_path, path)
+    except Exception as e:
+        log_info(f"指标导出失败: {e}")
 
-# ===== API 功能 =====
+def schedule_metrics_export():
+    """按 metrics_export_interval 周期导出指标"""
+    global metrics_export_timer
+    if not config.get('metrics_export', False):
+        metrics_export_timer = None
+        return
+    interval = max(5, float(config.get('metrics_export_interval', 60)))
+
+    def task():
+        engine.run_in_background(export_metrics)
+        schedule_metrics_export()
 
-def api_display_number(display_name, number):
+    metrics_export_timer = engine.call_later(interval, task)
+
+def get_trace_path(prefix):
+    """生成数据目录下带时间戳的追踪输出路径（不含扩展名）"""
+    return os.path.join(server_inst.get_data_folder(), f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+def start_trace(profile=False):
     """
-    API: 在其他显示板上显示指定数字
-    :param display_name: 显示板名称
-    :param number: 要显示的数字
-    :return: 成功返回True，失败返回False和错误信息
+    开始记录定时更新各阶段的耗时区间
+    :param profile: 是否同时在下一轮定时更新中使用 cProfile 采集
+    :return: 是否已开始（已在追踪时为 False）
     """
-    display_config = get_display_config(display_name)
-    if not display_config:
-        return False, f"显示板 '{display_name}' 不存在"
-    
-    if not display_config.get('open_api', False):
-        return False, f"显示板 '{display_name}' 未开放API"
-    
+    started = tracer.start()
+    if profile:
+        tracer.request_profile(get_trace_path('profile'))
+    return started
+
+def stop_trace():
+    """
+    停止追踪并将记录写入数据目录（Chrome Trace 格式）
+    :return: (文件路径, 记录的区间数)，未在追踪时为 (None, 0)
+    """
+    trace = tracer.stop()
+    if trace is None:
+        return None, 0
+    path = get_trace_path('trace') + '.json'
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(trace, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temp_path, path)
+    return path, sum(1 for event in trace['traceEvents'] if event['ph'] == 'X')
+
+# ===== 事件通知 =====
+
+def dispatch_plugin_event(name, args):
+    """向其他插件派发 MCDR 事件（事件ID为 follower_display.<name>）"""
+    if server_inst is None:
+        return
     try:
-        number = int(number)
-        display_number(server_inst, number, display_name, only_changed=False)
-        return True, f"已在显示板 '{display_name}' 上显示数字 {number}"
-    except ValueError:
-        return False, "数字格式错误"
+        server_inst.dispatch_event(LiteralEvent(f"{PLUGIN_METADATA['id']}.{name}"), args)
+        metrics.inc('events_dispatched_total')
     except Exception as e:
-        return False, f"显示失败: {str(e)}"
+        log_info(f"事件派发失败 ({name}): {e}")
+
+def get_crossed_milestone(old_fans, new_fans):
+    """
+    获取粉丝数从 old_fans 变为 new_fans 时越过的里程碑（milestone_step 的整数倍及 milestones 中的值）
+    越过多个时，上涨取最大的一个，下降取最小的一个
+    :return: 里程碑数值，未越过时返回 None
+    """
+    low, high = min(old_fans, new_fans), max(old_fans, new_fans)
+    crossed = [m for m in config.get('milestones', []) if low < m <= high]
+    step = int(config.get('milestone_step', 10000))
+    if step > 0 and high // step > low // step:
+        crossed.append(high // step * step if new_fans > old_fans else (low // step + 1) * step)
+    if not crossed:
+        return None
+    return max(crossed) if new_fans > old_fans else min(crossed)
+
+def notify_display_result(display, data):
+    """
+    根据显示板的查询结果派发事件（同一显示板按 event_debounce 合并）：
+    count_changed(显示板, MID, 旧值, 新值)、milestone(显示板, MID, 里程碑, 旧值, 新值)、fetch_failed(显示板, MID, 返回码, 信息)
+    """
+    if data.get('stale'):
+        return  # 暂停查询期间的旧数据
+    display_name = display['name']
+    debounce = max(0.0, float(config.get('event_debounce', 30)))
+    now = time.monotonic()
+    with event_lock:
+        state = event_states.setdefault(display_name, {
+            'reported': None, 'latest': None, 'mid': display['mid'],
+            'last_emit': 0.0, 'timer': None, 'failing': False, 'last_failure': 0.0
+        })
+        if state['mid'] != display['mid']:
+            # MID 已更换，重新记录基准值
+            state.update(reported=None, latest=None, mid=display['mid'])
+        if data.get('code') != 0:
+            # 首次失败立即通知，持续失败时每个合并周期最多通知一次
+            if state['failing'] and now - state['last_failure'] < debounce:
+                return
+            state['failing'] = True
+            state['last_failure'] = now
+            failure = (display_name, display['mid'], data.get('code', -1), data.get('message', ''))
+        else:
+            failure = None
+            state['failing'] = False
+            fans = data['data']['card']['fans']
+            if state['reported'] is None:
+                # 首次查询只记录基准值
+                state['reported'] = state['latest'] = fans
+                return
+            state['latest'] = fans
+            if state['timer'] is not None:
+                return  # 已安排在合并周期结束时通知
+            wait = debounce - (now - state['last_emit'])
+            if wait > 0:
+                state['timer'] = engine.call_later(wait, engine.run_in_background, flush_count_event, display_name)
+                return
+    if failure is not None:
+        dispatch_plugin_event('fetch_failed', failure)
+    else:
+        flush_count_event(display_name)
+
+def flush_count_event(display_name):
+    """派发合并周期内累计的粉丝数变化（数值变回原值时不派发）"""
+    with event_lock:
+        state = event_states.get(display_name)
+        if state is None:
+            return
+        state['timer'] = None
+        old_fans, new_fans = state['reported'], state['latest']
+        if old_fans is None or old_fans == new_fans:
+            return
+        state['reported'] = new_fans
+        state['last_emit'] = time.monotonic()
+        mid = state['mid']
+    dispatch_plugin_event('count_changed', (display_name, mid, old_fans, new_fans))
+    milestone = get_crossed_milestone(old_fans, new_fans)
+    if milestone is not None:
+        log_info(f"🎉 显示板 '{display_name}' 粉丝数越过 {milestone:,} ({old_fans:,} → {new_fans:,})")
+        dispatch_plugin_event('milestone', (display_name, mid, milestone, old_fans, new_fans))
 
 # ===== 定时任务控制 =====
 
-def update_next_display():
-    """更新下一个显示板"""
-    global current_update_index, is_updating
-    
-    # 检查是否所有显示板都已更新完成
-    if current_update_index >= len(config['displays']):
-        is_updating = False
-        current_update_index = 0
-        log_info("✅ 所有显示板更新完成")
-        return
-    
-    # 获取当前要更新的显示板
-    display = config['displays'][current_update_index]
+def should_redraw(display, old_fans, fans):
+    """changed 模式下判断显示板是否需要重绘"""
+    if old_fans is None:
+        return True
+    if abs(fans - old_fans) < max(1, int(display.get('min_delta', 1))):
+        return False
+    last_redraw = last_redraw_times.get(display['name'])
+    min_interval = float(display.get('min_redraw_interval', 0))
+    if last_redraw is not None and time.monotonic() - last_redraw < min_interval:
+        return False
+    return True
+
+def update_display(display, data=None, callback=None, cycle=None):
+    """
+    更新单个显示板
+    :param display: 显示板配置
+    :param data: 已查询到的接口数据，None 时现场查询
+    :param callback: 更新结束（成功、跳过或失败）后的回调函数
+    :param cycle: 所属的定时更新轮次，用于性能追踪
+    """
+    with tracer.profiled(), tracer.span('update_display', display=display['name'], cycle=cycle):
+        update_display_now(display, data, callback, cycle)
+
+def update_display_now(display, data, callback, cycle):
+    """update_display 的实际处理"""
     display_name = display['name']
     mid = display['mid']
     
@@ -255,155 +2632,635 @@ def update_next_display():
     
     # 获取当前粉丝数
     old_fans = load_cache(display_name)
-    data = get_follower_count(mid)
+    if data is None:
+        with tracer.span('get_follower_count', display=display_name, mid=mid):
+            data = get_follower_count(mid)
+    notify_display_result(display, data)
     
+    if data.get('code') == 0 and data.get('stale'):
+        # 暂停查询期间返回的是上次的数据，显示板上已是该数值
+        log_debug(f"显示板 '{display_name}' 的 MID 暂停查询中，{data['retry_in']:.0f}s 后恢复，保持当前显示")
+        if callback:
+            callback()
+        return
+
     if data.get('code') == 0:
         fans = data['data']['card']['fans']
         name = data['data']['card']['name']
+
+        if config.get('update_mode', 'all') == 'changed' and not should_redraw(display, old_fans, fans):
+            log_debug(f"显示板 '{display_name}' 无需重绘 ({old_fans:,} → {fans:,})")
+            if callback:
+                callback()
+            return
+        last_redraw_times[display_name] = time.monotonic()
         
         if old_fans is not None:
             server_inst.say(f"🔄 {name} ({display_name}): {old_fans:,} → {fans:,}")
         else:
             server_inst.say(f"🎨 正在显示 {name} 的粉丝数到 '{display_name}' 显示板...")
         
-        # 显示数字，完成后更新下一个显示板
         display_number(
             server_inst, 
             fans, 
             display_name, 
             only_changed=(old_fans is not None),
-            callback=lambda: update_next_display_callback(display_name, fans, old_fans)
+            callback=callback,
+            group='scheduled',
+            cycle=cycle
         )
     else:
         server_inst.say(f"❌ 显示板 '{display_name}' 更新失败")
-        # 即使失败也继续更新下一个
-        current_update_index += 1
-        update_next_display()
-
-def update_next_display_callback(display_name, new_fans, old_fans):
-    """更新完成后的回调函数"""
-    global current_update_index
-    # 保存新的粉丝数
-    save_cache(new_fans, display_name)
-    # 更新下一个显示板
-    current_update_index += 1
-    update_next_display()
+        if callback:
+            callback()
+
+def get_poll_bounds():
+    """获取轮询间隔的上下限（秒）"""
+    min_interval = max(1.0, float(config.get('poll_min_interval', 10)))
+    max_interval = max(min_interval, float(config.get('poll_max_interval', 600)))
+    return min_interval, max_interval
+
+def sync_poll_states():
+    """根据当前配置增删各 MID 的轮询状态（调用方需持有 poll_lock）"""
+    mids = get_monitored_mids()
+    for mid in list(poll_states):
+        if mid not in mids:
+            del poll_states[mid]
+    min_interval, max_interval = get_poll_bounds()
+    initial = min(max(float(config['update_interval']), min_interval), max_interval)
+    new_mids = [mid for mid in mids if mid not in poll_states]
+    now = time.monotonic()
+    for i, mid in enumerate(new_mids):
+        # 首次查询时间在一个周期内错开，避免同时发出所有请求
+        poll_states[mid] = {
+            'interval': initial,
+            'next_due': now + initial * (i + 1) / len(new_mids),
+            'last_fans': None,
+            'polls': 0,
+            'changes': 0,
+            'failures': 0
+        }
+
+def adjust_poll_interval(state, data):
+    """
+    根据查询结果调整 MID 的轮询间隔（调用方需持有 poll_lock）
+    粉丝数有变化时缩短间隔，无变化时按 poll_backoff 倍数延长，查询失败时加倍
+    """
+    min_interval, max_interval = get_poll_bounds()
+    interval = state['interval']
+    state['polls'] += 1
+    if data.get('code') != 0:
+        state['failures'] += 1
+        interval *= 2
+    else:
+        fans = data['data']['card']['fans']
+        state['failures'] = 0
+        if state['last_fans'] is not None and fans != state['last_fans']:
+            state['changes'] += 1
+            interval /= 2
+        else:
+            interval *= max(1.0, float(config.get('poll_backoff', 1.5)))
+        state['last_fans'] = fans
+    state['interval'] = min(max(interval, min_interval), max_interval)
+
+def select_due_mids():
+    """选出已到查询时间的 MID（受每分钟请求预算限制，最久未查询的优先）"""
+    now = time.monotonic()
+    with poll_lock:
+        sync_poll_states()
+        while poll_request_times and now - poll_request_times[0] >= 60:
+            poll_request_times.popleft()
+        budget = max(1, int(config.get('max_requests_per_minute', 60))) - len(poll_request_times)
+        due = sorted(
+            (mid for mid, state in poll_states.items()
+             if state['next_due'] <= now and mid not in polling_mids and get_fetch_block(mid) <= 0),
+            key=lambda mid: poll_states[mid]['next_due']
+        )
+        if len(due) > budget:
+            metrics.inc('poll_deferred_total', len(due) - max(budget, 0))
+            log_debug(f"已达到每分钟请求上限，推迟 {len(due) - max(budget, 0)} 个MID的查询")
+            due = due[:max(budget, 0)]
+        for mid in due:
+            polling_mids.add(mid)
+            poll_request_times.append(now)
+    return due
+
+async def poll_mids(mids, generation):
+    """查询一批 MID 并更新对应的显示板（一次调用为一个更新轮次，所有显示结束后轮次结束）"""
+    cycle = next(poll_cycle_ids)
+    cycle_start = time.perf_counter()
+    pending_mids = {'count': len(mids)}
+    tracer.begin_profile(cycle)
+
+    def finish_cycle(count=1):
+        with poll_lock:
+            pending_mids['count'] -= count
+            if pending_mids['count'] > 0:
+                return
+        tracer.record('cycle', cycle_start, time.perf_counter(), {'cycle': cycle, 'mids': mids}, track='更新轮次')
+        tracer.end_profile(cycle)
+
+    def report_error(stage, e):
+        metrics.inc('poll_errors_total')
+        if server_inst:
+            server_inst.logger.warning(f"[Bilibili] 定时更新{stage}出错: {e!r}")
+
+    with tracer.profiled(), tracer.context(cycle=cycle):
+        try:
+            with tracer.span('fetch', mids=len(mids)):
+                results = await fetch_follower_counts_async(mids)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 查询出错（如重载后查询线程池已关闭）时释放本轮所有 MID，下次到期时重新查询
+            report_error('查询', e)
+            for mid in mids:
+                finish_poll(mid, generation)
+            finish_cycle(len(mids))
+            return
+        for index, mid in enumerate(mids):
+            data = results.get(mid, {'code': -1})
+            with poll_lock:
+                expired = generation != poll_generation
+                state = None if expired else poll_states.get(mid)
+                if state is not None:
+                    adjust_poll_interval(state, data)
+            if expired:
+                finish_cycle(len(mids) - index)
+                return
+            displays = get_displays_by_mid(mid)
+            if not displays:
+                finish_poll(mid, generation)
+                finish_cycle()
+                continue
+            remaining = {'count': len(displays)}
+
+            def on_done(mid=mid, remaining=remaining):
+                with poll_lock:
+                    remaining['count'] -= 1
+                    if remaining['count'] > 0:
+                        return
+                finish_poll(mid, generation)
+                finish_cycle()
+
+            for display in displays:
+                # 每个显示板只计一次完成：出错前可能已调用过回调
+                done = {'called': False}
+
+                def callback(done=done, on_done=on_done):
+                    with poll_lock:
+                        if done['called']:
+                            return
+                        done['called'] = True
+                    on_done()
+
+                try:
+                    update_display(display, data, callback, cycle)
+                except Exception as e:
+                    # 如接口返回的数据缺少字段，出错的显示板视为已结束，MID 照常进入下一次查询
+                    report_error(f"显示板 '{display['name']}' ", e)
+                    callback()
+
+def finish_poll(mid, generation):
+    """MID 的查询和显示全部结束后安排下一次查询"""
+    with poll_lock:
+        if generation != poll_generation:
+            return
+        polling_mids.discard(mid)
+        state = poll_states.get(mid)
+        if state is not None:
+            state['next_due'] = time.monotonic() + state['interval']
+
+async def poll_loop(generation):
+    """轮询调度协程：每秒检查一次哪些 MID 到期"""
+    while scheduler_running and generation == poll_generation:
+        due = select_due_mids()
+        metrics.inc('poll_ticks_total')
+        if due:
+            log_debug(f"⏱️ 开始查询 {len(due)} 个MID: {', '.join(due)}")
+            asyncio.ensure_future(poll_mids(due, generation))
+        tick_start = time.monotonic()
+        await asyncio.sleep(POLL_TICK)
+        # 实际唤醒时间与预期的差值，反映事件循环是否被阻塞
+        metrics.observe('poll_tick_lag_seconds', max(0.0, time.monotonic() - tick_start - POLL_TICK))
 
 def start_scheduled_update():
-    """启动定时更新任务"""
-    global update_timer, is_updating, scheduler_running
+    """启动定时更新任务（按各 MID 的变化频率自适应轮询）"""
+    global update_timer, scheduler_running, poll_generation
     if update_timer is not None:
         return  # 已在运行
     
     scheduler_running = True
+    with poll_lock:
+        poll_generation += 1
+        poll_states.clear()
+        polling_mids.clear()
+        sync_poll_states()
 
-    def task():
-        global update_timer, is_updating, current_update_index, scheduler_running
-        if not scheduler_running:
-            return  # 如果定时任务已停止，不再执行
-            
-        if is_updating:
-            log_info("⏱️ 跳过本次更新（上次更新仍在进行中）")
-        else:
-            is_updating = True
-            current_update_index = 0
-            log_info("⏱️ 开始顺序更新所有显示板")
-            update_next_display()
-        
-        # 只有在定时任务仍在运行时才设置下一个定时器
-        if scheduler_running:
-            update_timer = threading.Timer(config['update_interval'], task)
-            update_timer.start()
-
-    update_timer = threading.Timer(config['update_interval'], task)
-    update_timer.start()
-    server_inst.say(f"✅ 自动更新已启动，周期 {config['update_interval']} 秒")
+    update_timer = engine.submit(poll_loop(poll_generation))
+    min_interval, max_interval = get_poll_bounds()
+    server_inst.say(f"✅ 自动更新已启动，初始周期 {config['update_interval']} 秒（自适应 {min_interval:g}~{max_interval:g} 秒）")
 
 def stop_scheduled_update():
     """停止定时更新"""
-    global update_timer, is_updating, current_update_index, scheduler_running
+    global update_timer, scheduler_running, poll_generation
     scheduler_running = False
     if update_timer is not None:
         update_timer.cancel()
         update_timer = None
-    is_updating = False
-    current_update_index = 0
+    with poll_lock:
+        poll_generation += 1
+        polling_mids.clear()
+    cancel_renders('scheduled')
     server_inst.say("🛑 自动更新已停止")
 
+def get_poll_status():
+    """获取各 MID 的轮询状态 {mid: {'interval', 'next_in', 'polls', 'changes', 'failures', 'blocked_in'}}"""
+    now = time.monotonic()
+    with poll_lock:
+        status = {
+            mid: {
+                'interval': state['interval'],
+                'next_in': max(0.0, state['next_due'] - now),
+                'polls': state['polls'],
+                'changes': state['changes'],
+                'failures': state['failures']
+            }
+            for mid, state in poll_states.items()
+        }
+    for mid, state in status.items():
+        state['blocked_in'] = get_fetch_block(mid)
+    return status
+
 def get_task_status():
     """获取任务状态"""
     status = "运行中" if update_timer is not None else "已停止"
-    if is_updating:
-        status += " (正在更新)"
+    with poll_lock:
+        updating = len(polling_mids)
+    if updating:
+        status += f" (正在更新 {updating} 个MID)"
+    backoff = get_backoff_status()
+    if backoff['throttle_remaining'] > 0:
+        status += f"，⚠ 触发风控，{backoff['throttle_remaining']:.0f}s 后恢复请求"
+    if backoff['circuits']:
+        status += f"，{len(backoff['circuits'])} 个MID连续失败暂停查询中"
     return status
 
 # ===== 重载功能 =====
 
+def get_config_mtime():
+    """获取配置文件的修改时间，文件不存在时返回 None"""
+    try:
+        return os.path.getmtime(os.path.join(server_inst.get_data_folder(), CONFIG_FILE))
+    except OSError:
+        return None
+
+def remember_config_mtime():
+    """记录配置文件当前的修改时间（插件自身写入后调用，避免触发自动重载）"""
+    global config_mtime
+    config_mtime = get_config_mtime()
+
+def read_config_file(config_path):
+    """
+    读取并校验配置文件
+    :return: 文件中的配置，格式错误时抛出 ValueError
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        user_config = json.load(f)
+
+    if not isinstance(user_config, dict):
+        raise ValueError("配置文件内容不是 JSON 对象")
+    if not isinstance(user_config.get('displays'), list):
+        raise ValueError("配置文件缺少必要的 displays 字段")
+    names = set()
+    for display in user_config['displays']:
+        if not isinstance(display, dict) or 'name' not in display or 'mid' not in display:
+            raise ValueError("显示板配置缺少 name 或 mid 字段")
+        if display['name'] in names:
+            raise ValueError(f"显示板名称重复: {display['name']}")
+        names.add(display['name'])
+        backend = display.get('render_backend') or user_config.get('render_backend') or config.get('render_backend', 'commands')
+        if backend == 'blocks':
+            # 字形设置按新配置中的全局值检查
+            error = check_digit_positions(dict(
+                {key: user_config[key] for key in DEFAULT_GLYPH_OPTIONS if user_config.get(key)}, **display))
+            if error:
+                raise ValueError(f"显示板 '{display['name']}' 配置有误: {error}")
+    return user_config
+
+def diff_config(new_config):
+    """
+    比较新配置与当前配置
+    :return: {'added': [名称], 'removed': [名称], 'changed': {名称: [变更字段]}, 'globals': [变更的全局字段]}
+    """
+    old_displays = {display['name']: display for display in config['displays']}
+    new_displays = {display['name']: display for display in new_config['displays']}
+    changed = {}
+    for name, display in new_displays.items():
+        old = old_displays.get(name)
+        if old is not None and old != display:
+            changed[name] = sorted(key for key in set(old) | set(display) if old.get(key) != display.get(key))
+    return {
+        'added': [name for name in new_displays if name not in old_displays],
+        'removed': [name for name in old_displays if name not in new_displays],
+        'changed': changed,
+        'globals': [key for key in new_config if key != 'displays' and config.get(key) != new_config[key]]
+    }
+
+def clamp_poll_intervals():
+    """轮询间隔上下限变化后，将各 MID 当前的间隔限制到新范围内"""
+    min_interval, max_interval = get_poll_bounds()
+    now = time.monotonic()
+    with poll_lock:
+        for state in poll_states.values():
+            state['interval'] = min(max(state['interval'], min_interval), max_interval)
+            state['next_due'] = min(state['next_due'], now + state['interval'])
+
+def apply_config_diff(new_config, diff):
+    """将配置变更应用到运行中的定时任务、显示队列和缓存，未变更的显示板不受影响"""
+    global metrics_export_timer
+    changed = diff['changed']
+    old_displays = {display['name']: display for display in config['displays']}
+    # 未变更的显示板沿用原配置对象，进行中的显示任务不受影响
+    config['displays'] = [
+        old_displays[display['name']] if display['name'] in old_displays and display['name'] not in changed else display
+        for display in new_config['displays']
+    ]
+    for key in diff['globals']:
+        config[key] = new_config[key]
+    rebuild_display_index()
+
+    changed_globals = set(diff['globals'])
+    inherited_globals = changed_globals & set(GLOBAL_LAYOUT_KEYS)
+    # 沿用了变更的全局显示设置的显示板（字形相关的设置只影响 blocks 显示方式）
+    inherited = [display['name'] for display in config['displays']
+                 if any(not display.get(key) and (key == 'render_backend' or get_render_backend(display) == 'blocks')
+                        for key in inherited_globals)]
+    stale = diff['removed'] + inherited + [name for name, keys in changed.items() if set(keys) & set(DISPLAY_RENDER_KEYS)]
+    if stale:
+        cancel_renders(displays=stale)
+    relayout = diff['removed'] + inherited + [name for name, keys in changed.items() if set(keys) & set(DISPLAY_LAYOUT_KEYS)]
+    if relayout:
+        drop_cache(relayout)
+    for name in diff['removed']:
+        last_redraw_times.pop(name, None)
+        with event_lock:
+            event_states.pop(name, None)
+    for name in diff['removed'] + [name for name, keys in changed.items() if 'delay_between_commands' in keys]:
+        command_delays.pop(name, None)
+
+    if changed_globals & set(HTTP_CONFIG_KEYS):
+        # 并发数/连接池参数变化，下次查询时按新配置重建
+        shutdown_fetch_executor()
+        close_http_session()
+    if changed_globals & set(RATE_LIMIT_CONFIG_KEYS):
+        reset_rate_limiter()
+    if changed_globals & set(FOLLOWER_CACHE_CONFIG_KEYS):
+        clear_follower_cache()
+    if changed_globals & set(POLL_CONFIG_KEYS):
+        clamp_poll_intervals()
+    if changed_globals & set(METRICS_CONFIG_KEYS):
+        if metrics_export_timer is not None:
+            metrics_export_timer.cancel()
+        schedule_metrics_export()
+    if 'config_watch_interval' in changed_globals:
+        schedule_config_watch()
+    # 删除的显示板、更换的假人以及关闭 keep_bot_alive 后遗留的假人
+    release_idle_bots()
+    # max_concurrent_renders 可能变大
+    dispatch_renders()
+    # 新增/删除的 MID 由定时任务在下一次检查时同步
+
+def format_config_diff(diff):
+    """生成配置变更摘要"""
+    parts = []
+    if diff['added']:
+        parts.append(f"新增 {', '.join(diff['added'])}")
+    if diff['removed']:
+        parts.append(f"移除 {', '.join(diff['removed'])}")
+    if diff['changed']:
+        parts.append(f"修改 {', '.join(diff['changed'])}")
+    if diff['globals']:
+        parts.append(f"全局设置 {', '.join(diff['globals'])}")
+    return "；".join(parts) if parts else "无变化"
+
 def reload_config():
-    """重新加载配置文件"""
-    global config
-    
+    """重新加载配置文件，只将变更部分应用到运行中的任务（定时任务不会中断）"""
+    global config_mtime
+    config_path = os.path.join(server_inst.get_data_folder(), CONFIG_FILE)
+    if not os.path.isfile(config_path):
+        server_inst.say("❌ 配置文件不存在")
+        return False
+
+    with config_reload_lock:
+        mtime = get_config_mtime()
+        try:
+            # 文件中缺少的字段沿用当前值
+            new_config = dict(config)
+            new_config.update(read_config_file(config_path))
+        except Exception as e:
+            server_inst.say(f"❌ 配置格式错误: {str(e)}")
+            log_info(f"配置重载失败: {str(e)}")
+            return False
+        # 记录已读取的版本，避免文件检查重复触发重载
+        config_mtime = mtime
+
+        diff = diff_config(new_config)
+        try:
+            apply_config_diff(new_config, diff)
+        except Exception as e:
+            server_inst.say(f"❌ 重载配置失败: {str(e)}")
+            log_info(f"重载配置失败: {str(e)}")
+            return False
+
+    summary = format_config_diff(diff)
+    server_inst.say(f"✅ 配置已重载: {summary}")
+    log_info(f"配置文件重载成功: {summary}")
+    return True
+
+def check_config_file():
+    """检查配置文件是否被修改，修改时间连续两次检查不变（写入完成）后自动重载"""
+    global pending_config_mtime
     try:
-        config_path = os.path.join(server_inst.get_data_folder(), 'bfanconfig.json')
-        if os.path.isfile(config_path):
-            # 先备份当前配置，以防重载失败
-            old_config = config.copy()
-            
-            # 停止当前定时任务
-            was_running = (update_timer is not None)
-            if was_running:
-                stop_scheduled_update()
-            
-            try:
-                # 读取新配置
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    user_config = json.load(f)
-                
-                # 验证配置格式
-                if 'displays' not in user_config:
-                    raise ValueError("配置文件缺少必要的 displays 字段")
-                
-                # 更新配置
-                config.clear()
-                config.update(user_config)
-                
-                # 保存配置到临时位置验证
-                temp_path = os.path.join(server_inst.get_data_folder(), 'bfanconfig_temp.json')
-                with open(temp_path, 'w', encoding='utf-8') as f:
-                    json.dump(config, f, indent=2, ensure_ascii=False)
-                
-                # 删除临时文件
-                os.remove(temp_path)
-                
-                # 如果之前定时任务在运行，重新启动
-                if was_running:
-                    start_scheduled_update()
-                
-                server_inst.say("✅ 配置已重载")
-                log_info("配置文件重载成功")
-                return True
-                
-            except Exception as e:
-                # 恢复旧配置
-                config.clear()
-                config.update(old_config)
-                
-                # 重新启动定时任务（如果之前在运行）
-                if was_running:
-                    start_scheduled_update()
-                
-                server_inst.say(f"❌ 配置格式错误: {str(e)}")
-                log_info(f"配置重载失败: {str(e)}")
-                return False
-        else:
-            server_inst.say("❌ 配置文件不存在")
+        mtime = get_config_mtime()
+        if mtime is None or mtime == config_mtime:
+            pending_config_mtime = None
+            return
+        if mtime != pending_config_mtime:
+            pending_config_mtime = mtime
+            return
+        pending_config_mtime = None
+        log_info("检测到配置文件已修改，自动重载")
+        reload_config()
+    finally:
+        schedule_config_watch()
+
+def schedule_config_watch():
+    """按 config_watch_interval 周期检查配置文件（重复调用时替换之前的检查任务）"""
+    global config_watch_timer
+    with config_reload_lock:
+        if config_watch_timer is not None:
+            config_watch_timer.cancel()
+        interval = float(config.get('config_watch_interval', 5))
+        if interval <= 0 or not engine.running:
+            config_watch_timer = None
+            return
+        config_watch_timer = engine.call_later(max(1.0, interval), engine.run_in_background, check_config_file)
+    
+# ===== 命令处理 =====
+
+def run_command_in_background(server, key, func, *args, ack=None, hold_until_done=False):
+    """
+    在后台执行命令处理函数，避免网络/文件操作阻塞 MCDR 的 on_info 线程
+    :param key: 命令标识，同一标识的命令执行完成前不会重复执行
+    :param ack: 立即回复给玩家的提示
+    :param hold_until_done: 为 True 时 func 需接收 done 参数，并在真正完成（如显示结束）后调用
+    :return: 是否已开始执行
+    """
+    with running_commands_lock:
+        if key in running_commands:
+            server.say("⏳ 相同的命令仍在执行中，请稍后再试")
             return False
-    except Exception as e:
-        server_inst.say(f"❌ 重载配置失败: {str(e)}")
-        log_info(f"重载配置失败: {str(e)}")
+        running_commands.add(key)
+
+    def done():
+        with running_commands_lock:
+            running_commands.discard(key)
+
+    def task():
+        try:
+            if hold_until_done:
+                func(*args, done=done)
+            else:
+                func(*args)
+        except Exception as e:
+            server.say(f"❌ 命令执行失败: {e}")
+            done()
+            return
+        if not hold_until_done:
+            done()
+
+    if ack:
+        server.say(ack)
+    if engine.run_in_background(task) is None:
+        done()
+        server.say("❌ 插件后台任务未运行")
         return False
+    return True
+
+def save_config():
+    """在后台保存配置文件"""
+    def task():
+        with config_save_lock:
+            server_inst.save_config_simple(config, CONFIG_FILE)
+            remember_config_mtime()
+    engine.run_in_background(task)
+
+def command_status(server):
+    """!!fan：查询所有显示板状态"""
+    display_list = []
+    results = fetch_follower_counts(get_monitored_mids())
+    for display in config['displays']:
+        data = results.get(str(display['mid']), {'code': -1})
+        notify_display_result(display, data)
+        if data.get('code') == 0:
+            fans = data['data']['card']['fans']
+            name = data['data']['card']['name']
+            stale = "（暂停查询，显示上次结果）" if data.get('stale') else ""
+            display_list.append(f"{display['name']}: {name}({fans:,}){stale}")
+        else:
+            display_list.append(f"{display['name']}: 查询失败")
     
-# ===== 命令处理 =====
+    server.say("📊 所有显示板状态:\n" + "\n".join(display_list))
+
+def command_history(server, display_name, hours):
+    """!!fan history：显示指定显示板最近一段时间的粉丝数变化"""
+    display_config = get_display_config(display_name)
+    if not display_config:
+        server.say(f"❌ 显示板 '{display_name}' 不存在")
+        return
+    display_name = display_config['name']
+    since = time.time() - hours * 3600
+    # 首尾取范围内的原始记录，降采样的数据只用于逐行列出（每个间隔只保留最后一条，会丢失第一个间隔内的变化）
+    edges = history.endpoints(display_config['mid'], since)
+    if edges is None:
+        server.say(f"ℹ {display_name} 最近 {hours:g} 小时暂无历史记录")
+        return
+    points = get_history(display_name, since, max(60, int(hours * 3600 / HISTORY_COMMAND_POINTS)))
+
+    (first_time, first_fans), (last_time, last_fans) = edges
+    elapsed_hours = (last_time - first_time) / 3600
+    rate = f"，平均 {(last_fans - first_fans) / elapsed_hours:+,.1f}/小时" if elapsed_hours > 0 else ""
+    lines = [f"📈 {display_name} 最近 {hours:g} 小时: {first_fans:,} → {last_fans:,} ({last_fans - first_fans:+,}){rate}"]
+    previous = first_fans
+    for timestamp, fans in points[-HISTORY_COMMAND_POINTS:]:
+        lines.append(f"  {time.strftime('%m-%d %H:%M', time.localtime(timestamp))}  {fans:,} ({fans - previous:+,})")
+        previous = fans
+    server.say("\n".join(lines))
+
+def command_trace(server, action, profile):
+    """!!fan trace：开始/停止性能追踪"""
+    if action == 'start':
+        if start_trace(profile):
+            message = "🔍 性能追踪已开始，使用 !!fan trace stop 停止并导出"
+        else:
+            message = "ℹ 性能追踪已在进行中，使用 !!fan trace stop 停止并导出"
+        if profile:
+            message += "\n下一轮定时更新将同时使用 cProfile 采集"
+            if update_timer is None:
+                message += "（自动更新未运行，需先 !!fan interval start）"
+        server.say(message)
+    elif action == 'stop':
+        status = tracer.get_status()
+        path, count = stop_trace()
+        if path is None:
+            server.say("ℹ 性能追踪未在进行中")
+            return
+        message = f"🔍 性能追踪已停止（{status['seconds']:.0f}s，{count} 个区间），已导出到 {os.path.basename(path)}"
+        if status['dropped']:
+            message += f"，超出上限丢弃 {status['dropped']} 个"
+        server.say(message)
+    else:
+        status = tracer.get_status()
+        if status['enabled']:
+            lines = [f"🔍 性能追踪进行中: {status['seconds']:.0f}s，已记录 {status['events']} 个区间"]
+        else:
+            lines = ["🔍 性能追踪未开启"]
+        if status['profile'] == 'pending':
+            lines.append("cProfile: 等待下一轮定时更新")
+        elif status['profile'] == 'running':
+            lines.append("cProfile: 采集中")
+        server.say("\n".join(lines))
+
+def command_display(server, display_name, only_changed, done):
+    """!!fan display / !!fan update：查询并显示到指定显示板，显示结束后调用 done"""
+    display_config = get_display_config(display_name)
+    if not display_config:
+        server.say(f"❌ 显示板 '{display_name}' 不存在")
+        done()
+        return
+    display_name = display_config['name']
+
+    old_fans = load_cache(display_name)
+    if only_changed and old_fans is None:
+        server.say(f"⚠ 请先使用 !!fan display {display_name} 初始化显示")
+        done()
+        return
+
+    data = get_follower_count(display_config['mid'])
+    notify_display_result(display_config, data)
+    if data.get('code') != 0:
+        server.say("❌ 更新失败" if only_changed else "❌ 显示失败，请检查MID或网络")
+        done()
+        return
+
+    fans = data['data']['card']['fans']
+    name = data['data']['card']['name']
+    if only_changed:
+        server.say(f"🔄 {name} ({display_name}): {old_fans:,} → {fans:,}")
+    else:
+        server.say(f"🎨 正在显示 {name} 的粉丝数到 '{display_name}' 显示板...")
+    display_number(server, fans, display_name, only_changed=only_changed, callback=done)
 
 def on_info(server, info):
     global server_inst
@@ -424,17 +3281,7 @@ def on_info(server, info):
 
     # 1. 查询所有显示板状态
     if len(args) == 1:
-        display_list = []
-        for display in config['displays']:
-            data = get_follower_count(display['mid'])
-            if data.get('code') == 0:
-                fans = data['data']['card']['fans']
-                name = data['data']['card']['name']
-                display_list.append(f"{display['name']}: {name}({fans:,})")
-            else:
-                display_list.append(f"{display['name']}: 查询失败")
-        
-        server.say("📊 所有显示板状态:\n" + "\n".join(display_list))
+        run_command_in_background(server, 'status', command_status, server, ack="⏳ 正在查询所有显示板...")
 
     # 2. 设置显示板 MID
     elif len(args) >= 4 and args[1] == 'mid':
@@ -456,12 +3303,13 @@ def on_info(server, info):
             return
 
         display_config['mid'] = new_mid
-        server.save_config_simple(config, 'bfanconfig.json')
+        rebuild_display_index()
+        save_config()
         server.say(f"✅ 成功将 {display_name} 的 MID 从 {old_mid} 修改为 {new_mid}")
         return
 
     # 3. 设置API开关
-    elif len(args) >= 4 and args[1] == 'api':
+    elif len(args) >= 4 and args[1] == 'api' and args[2] != 'show':
         display_name = args[2]
         status = args[3].lower()
         
@@ -480,46 +3328,16 @@ def on_info(server, info):
             server.say("❌ 参数错误，使用 on/off")
             return
             
-        server.save_config_simple(config, 'bfanconfig.json')
-
-    # 4. 首次显示
-    elif len(args) >= 2 and args[1] == 'display':
-        display_name = args[2] if len(args) > 2 else 'main'
-        display_config = get_display_config(display_name)
-        if not display_config:
-            server.say(f"❌ 显示板 '{display_name}' 不存在")
-            return
-            
-        data = get_follower_count(display_config['mid'])
-        if data.get('code') == 0:
-            fans = data['data']['card']['fans']
-            name = data['data']['card']['name']
-            server.say(f"🎨 正在显示 {name} 的粉丝数到 '{display_name}' 显示板...")
-            display_number(server, fans, display_name, only_changed=False)
-        else:
-            server.say("❌ 显示失败，请检查MID或网络")
+        rebuild_display_index()
+        save_config()
 
-    # 5. 智能更新（仅变化位）
-    elif len(args) >= 2 and args[1] == 'update':
+    # 4. 首次显示 / 5. 智能更新（仅变化位）
+    elif len(args) >= 2 and args[1] in ('display', 'update'):
         display_name = args[2] if len(args) > 2 else 'main'
-        display_config = get_display_config(display_name)
-        if not display_config:
-            server.say(f"❌ 显示板 '{display_name}' 不存在")
-            return
-            
-        old_fans = load_cache(display_name)
-        if old_fans is None:
-            server.say(f"⚠ 请先使用 !!fan display {display_name} 初始化显示")
-            return
-
-        data = get_follower_count(display_config['mid'])
-        if data.get('code') == 0:
-            fans = data['data']['card']['fans']
-            name = data['data']['card']['name']
-            server.say(f"🔄 {name} ({display_name}): {old_fans:,} → {fans:,}")
-            display_number(server, fans, display_name, only_changed=True)
-        else:
-            server.say("❌ 更新失败")
+        run_command_in_background(
+            server, f'board:{display_name}', command_display, server, display_name, args[1] == 'update',
+            ack=f"⏳ 正在查询 '{display_name}' 的粉丝数...", hold_until_done=True
+        )
 
     # 6. API显示数字
     elif len(args) >= 4 and args[1] == 'api' and args[2] == 'show':
@@ -539,7 +3357,7 @@ def on_info(server, info):
     # 7. 日志开关
     elif args == ['!!fan', 'log', 'toggle']:
         config['log_enabled'] = not config['log_enabled']
-        server.save_config_simple(config, 'bfanconfig.json')
+        save_config()
         status = '开启' if config['log_enabled'] else '关闭'
         server.say(f"🔧 日志输出已 {status}")
 
@@ -553,14 +3371,14 @@ def on_info(server, info):
 
     # 9. 重载配置
     elif args == ['!!fan', 'reload']:
-        if reload_config():
-            server.say("✅ 插件配置已重载")
-        else:
-            server.say("❌ 配置重载失败，已恢复原配置")
+        def command_reload():
+            if not reload_config():
+                server.say("❌ 配置重载失败，当前配置未改变")
+        run_command_in_background(server, 'reload', command_reload)
 
     # 9. 定时任务控制
     elif args == ['!!fan', 'interval']:
-        if get_task_status() == "运行中":
+        if update_timer is not None:
             stop_scheduled_update()
         else:
             start_scheduled_update()
@@ -571,14 +3389,21 @@ def on_info(server, info):
         elif len(args) == 3:
             cmd = args[2]
             if cmd == 'status':
-                server.say(f"🔄 自动更新状态: {get_task_status()}")
+                lines = [f"🔄 自动更新状态: {get_task_status()}"]
+                for mid, state in get_poll_status().items():
+                    line = (f"  MID {mid}: 间隔 {state['interval']:.0f}s，{state['next_in']:.0f}s 后查询，"
+                            f"变化 {state['changes']}/{state['polls']} 次，连续失败 {state['failures']} 次")
+                    if state['blocked_in'] > 0:
+                        line += f"，暂停查询 {state['blocked_in']:.0f}s"
+                    lines.append(line)
+                server.say("\n".join(lines))
             elif cmd == 'start':
-                if get_task_status() == "运行中":
+                if update_timer is not None:
                     server.say("ℹ 自动更新已在运行中")
                 else:
                     start_scheduled_update()
             elif cmd == 'stop':
-                if get_task_status() == "已停止":
+                if update_timer is None:
                     server.say("ℹ 自动更新已停止")
                 else:
                     stop_scheduled_update()
@@ -588,7 +3413,7 @@ def on_info(server, info):
                     server.say("❌ 间隔不能少于5秒")
                     return
                 config['update_interval'] = interval
-                server.save_config_simple(config, 'bfanconfig.json')
+                save_config()
                 server.say(f"🕙更新间隔已设置为 {interval} 秒")
                 # 重启任务
                 if update_timer is not None:
@@ -599,7 +3424,32 @@ def on_info(server, info):
         else:
             server.say("❌ 用法: !!fan interval <5~3600> | start | stop | status")
 
-    # 10. 显示帮助
+    # 10. 运行统计
+    elif args == ['!!fan', 'stats']:
+        server.say(format_stats())
+
+    # 11. 粉丝数历史
+    elif len(args) >= 2 and args[1] == 'history':
+        display_name = args[2] if len(args) > 2 else 'main'
+        try:
+            hours = float(args[3]) if len(args) > 3 else HISTORY_DEFAULT_HOURS
+        except ValueError:
+            hours = 0
+        if not 0 < hours <= 24 * 366:
+            server.say("❌ 用法: !!fan history [显示板] [小时数]")
+            return
+        run_command_in_background(server, f'history:{display_name}', command_history, server, display_name, hours)
+
+    # 12. 性能追踪
+    elif len(args) >= 2 and args[1] == 'trace':
+        action = args[2] if len(args) > 2 else 'status'
+        profile = args[3:] == ['profile']
+        if action not in ('start', 'stop', 'status') or (len(args) > 3 and not (action == 'start' and profile)):
+            server.say("❌ 用法: !!fan trace start [profile] | stop | status")
+            return
+        run_command_in_background(server, 'trace', command_trace, server, action, profile)
+
+    # 13. 显示帮助
     elif args == ['!!fan', 'help']:
         server.reply(info, '''
 §7====== §6Bilibili 粉丝显示 §7======
@@ -609,21 +3459,115 @@ def on_info(server, info):
 §a!!fan api show <显示板> <数字> §f- 在指定显示板显示数字
 §a!!fan display [name] §f- 首次显示到指定显示板
 §a!!fan update [name] §f- 智能更新指定显示板
-§a!!fan reload §f- 重载配置文件
+§a!!fan reload §f- 重载配置文件（仅应用变更部分，修改文件后也会自动重载）
 §a!!fan displays §f- 列出所有显示板
 §a!!fan interval §f- 启/停自动更新
-§a!!fan interval status §f- 查看状态
-§a!!fan interval 30 §f- 设置间隔30秒
+§a!!fan interval status §f- 查看状态及各MID轮询间隔
+§a!!fan interval 30 §f- 设置初始间隔30秒
 §a!!fan log toggle §f- 切换日志
+§a!!fan stats §f- 查看运行统计
+§a!!fan history [name] [小时] §f- 查看粉丝数历史（默认24小时）
+§a!!fan trace start [profile] §f- 开始性能追踪（profile 同时采集下一轮 cProfile）
+§a!!fan trace stop §f- 停止追踪并导出 Chrome Trace 文件
 §7========================§r
         '''.strip())
         server.reply(info, "§7插件版本: §a" + PLUGIN_METADATA['version'] + " §7作者: §a" + PLUGIN_METADATA['author'])
 
 # ===== 插件生命周期 =====
 
+def load_config_file(server, config_path):
+    """
+    读取配置文件并合并到默认配置（兼容旧格式）
+    :return: 是否需要写回配置文件（文件不存在、迁移了旧格式或缺少新增字段）
+    """
+    if not os.path.isfile(config_path):
+        return True
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            user_config = json.load(f)
+    except Exception as e:
+        server.logger.warning(f"[Bilibili] 配置文件加载失败，使用默认值: {e}")
+        return True
+
+    save_needed = False
+    # 兼容旧配置文件
+    if 'displays' not in user_config:
+        # 迁移旧配置到新格式
+        old_mid = user_config.get('mid', '114514')
+        user_config['displays'] = [{
+            'name': 'main',
+            'mid': old_mid,
+            'open_api': True,
+            'digit_look_at': {
+                '0': '-2464 197 -947',
+                '1': '-2463 197 -947',
+                '2': '-2462 197 -946',
+                '3': '-2462 197 -945',
+                '4': '-2462 197 -944',
+                '5': '-2463 197 -943',
+                '6': '-2464 197 -943',
+                '7': '-2465 197 -943',
+                '8': '-2466 197 -944',
+                '9': '-2466 197 -945'
+            },
+            'reset_pos': '-2466 196 -947',
+            'spawn_pos': '-2464 198 -945',
+            'delay_between_commands': 1.0
+        }]
+        # 移除旧的mid配置
+        if 'mid' in user_config:
+            del user_config['mid']
+        server.logger.info("[Bilibili] 已迁移旧配置文件到新格式")
+        save_needed = True
+
+    if any(key not in user_config for key in config):
+        save_needed = True
+    config.update(user_config)
+    return save_needed
+
+def deferred_startup(server, save_needed):
+    """插件加载的后台部分：写回配置、载入缓存、建立 HTTP 会话、自动启动"""
+    timings = {}
+
+    start = time.perf_counter()
+    if save_needed:
+        # 保存配置（确保完整）
+        with config_save_lock:
+            server.save_config_simple(config, CONFIG_FILE)
+    remember_config_mtime()
+    timings['配置写入'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    load_cache_file()
+    timings['缓存载入'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_http_session()
+    timings['HTTP会话'] = time.perf_counter() - start
+
+    history.open(os.path.join(server.get_data_folder(), HISTORY_DIR))
+
+    displays = config['displays']
+    if len(displays) <= STARTUP_DISPLAY_LOG_LIMIT:
+        for display in displays:
+            api_status = "开放" if display.get('open_api', False) else "关闭"
+            server.logger.info(f"[Bilibili]   - {display['name']}: MID={display['mid']}, API={api_status}")
+    else:
+        server.logger.info("[Bilibili]   显示板较多，使用 !!fan displays 查看列表")
+
+    schedule_metrics_export()
+    schedule_config_watch()
+    # 自动启动定时任务
+    if config['auto_start']:
+        start_scheduled_update()
+
+    detail = "，".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items())
+    server.logger.info(f"[Bilibili] 后台初始化完成: {detail}")
+
 def on_load(server, old_module):
     global server_inst, plugin_instances
     server_inst = server
+    load_start = time.perf_counter()
 
     server.logger.info('[Bilibili] 插件正在加载...')
     server.logger.info('[Bilibili] 作者: 通义千问/小豆(DeepSeek/呜楠二改) 版本: 3.3.1')
@@ -634,54 +3578,11 @@ def on_load(server, old_module):
     data_folder = server.get_data_folder()
     os.makedirs(data_folder, exist_ok=True)
 
-    # 加载配置文件
-    config_path = os.path.join(data_folder, 'bfanconfig.json')
-    if os.path.isfile(config_path):
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                user_config = json.load(f)
-                
-                # 兼容旧配置文件
-                if 'displays' not in user_config:
-                    # 迁移旧配置到新格式
-                    old_mid = user_config.get('mid', '114514')
-                    user_config['displays'] = [{
-                        'name': 'main',
-                        'mid': old_mid,
-                        'open_api': True,
-                        'digit_look_at': {
-                            '0': '-2464 197 -947',
-                            '1': '-2463 197 -947',
-                            '2': '-2462 197 -946',
-                            '3': '-2462 197 -945',
-                            '4': '-2462 197 -944',
-                            '5': '-2463 197 -943',
-                            '6': '-2464 197 -943',
-                            '7': '-2465 197 -943',
-                            '8': '-2466 197 -944',
-                            '9': '-2466 197 -945'
-                        },
-                        'reset_pos': '-2466 196 -947',
-                        'spawn_pos': '-2464 198 -945',
-                        'delay_between_commands': 1.0
-                    }]
-                    # 移除旧的mid配置
-                    if 'mid' in user_config:
-                        del user_config['mid']
-                    server.logger.info("[Bilibili] 已迁移旧配置文件到新格式")
-                
-                config.update(user_config)
-        except Exception as e:
-            server.logger.warning(f"[Bilibili] 配置文件加载失败，使用默认值: {e}")
+    # 加载配置文件（快速路径：仅解析，不写回）
+    save_needed = load_config_file(server, os.path.join(data_folder, CONFIG_FILE))
 
-    # 保存配置（确保完整）
-    server.save_config_simple(config, 'bfanconfig.json')
-    server.logger.info(f"[Bilibili] 插件加载完成，自动启动={config['auto_start']}")
-    server.logger.info(f"[Bilibili] 已加载 {len(config['displays'])} 个显示板")
-    
-    for display in config['displays']:
-        api_status = "开放" if display.get('open_api', False) else "关闭"
-        server.logger.info(f"[Bilibili]   - {display['name']}: MID={display['mid']}, API={api_status}")
+    # 启动后台引擎
+    engine.start()
 
     # 注册帮助
     server.register_help_message('!!fan', 'B站粉丝数显示')
@@ -690,17 +3591,38 @@ def on_load(server, old_module):
     # 注册插件实例供其他插件调用
     plugin_instances[PLUGIN_METADATA['id']] = server
 
-    # 自动启动定时任务
-    if config['auto_start']:
-        start_scheduled_update()
+    server.logger.info(f"[Bilibili] 插件加载完成（{(time.perf_counter() - load_start) * 1000:.0f}ms），"
+                       f"已加载 {len(config['displays'])} 个显示板，自动启动={config['auto_start']}")
+
+    # 写回配置、载入缓存、建立 HTTP 会话和自动启动放到后台执行
+    engine.run_in_background(deferred_startup, server, save_needed)
 
 def on_unload(server):
     """插件卸载时停止任务"""
-    global plugin_instances, is_updating, current_update_index, scheduler_running
+    global plugin_instances, scheduler_running
     stop_scheduled_update()
-    is_updating = False
-    current_update_index = 0
+    cancel_renders()
     scheduler_running = False
+    flush_cache()
+    if metrics_export_timer is not None:
+        metrics_export_timer.cancel()
+    if config_watch_timer is not None:
+        config_watch_timer.cancel()
+    if config.get('metrics_export', False):
+        export_metrics()
+    tracer.cancel_profile()
+    if tracer.enabled:
+        try:
+            path, _ = stop_trace()
+            server.logger.info(f"[Bilibili] 性能追踪已导出到 {path}")
+        except Exception as e:
+            server.logger.warning(f"[Bilibili] 性能追踪导出失败: {e}")
+    engine.stop()
+    shutdown_fetch_executor()
+    close_http_session()
+    clear_follower_cache()
+    clear_backoff_state()
+    history.close()
     if PLUGIN_METADATA['id'] in plugin_instances:
         del plugin_instances[PLUGIN_METADATA['id']]
     server.logger.info("[Bilibili] 插件已卸载")
@@ -711,6 +3633,18 @@ def get_plugin_api():
     """返回插件API供其他插件调用"""
     return {
         'display_number': api_display_number,
+        'submit_display_number': api_submit_display_number,
         'get_display_config': get_display_config,
-        'get_all_displays': lambda: config['displays']
+        'get_all_displays': lambda: config['displays'],
+        'get_displays_by_mid': get_displays_by_mid,
+        'get_backoff_status': get_backoff_status,
+        'get_history': get_history,
+        'get_cache_stats': get_follower_cache_stats,
+        'plan_display_number': api_plan_display_number,
+        'get_poll_status': get_poll_status,
+        'get_metrics': get_metrics,
+        'get_metrics_prometheus': metrics.to_prometheus,
+        'start_trace': start_trace,
+        'stop_trace': stop_trace,
+        'get_trace_status': tracer.get_status
     }
\ No newline at end of file